@@ -5,19 +5,86 @@
 # file that should have been included as part of this package.
 
 
+import asyncio
+import hashlib
+import json
+import math
 import os
+import shutil
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
 
+import aiofiles
 import celery.states as states
-from celery import Celery
-from fastapi import BackgroundTasks, FastAPI, File, Request, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
-from typing import Optional, Dict
+import redis
+from celery import Celery, group
+from fastapi import BackgroundTasks, FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Optional, Dict, List
 
-UPLOAD_FOLDER = Path("/tmp/genea_visualizer")
-UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+import job_events
+import metrics
+import render_queue
+import wav_validation
+from artifact_store import FilesystemArtifactStore, link_or_copy
+from batch_archive import BatchArchiveError, delete_batch_files, extract_batch, write_outputs_archive
+from bvh_validation import BvhValidationError, validate_bvh_file
+from render_cache import RenderCache
+
+# the API always owns the upload folder; workers reach it through their own artifact store
+artifact_store = FilesystemArtifactStore()
+UPLOAD_FOLDER = artifact_store.folder
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 256 * 1024 ** 2))
+# /render takes two files, plus some room for the multipart framing
+MAX_REQUEST_BYTES = 2 * MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", 4 * 1024 ** 3))
+MAX_BATCH_JOBS = int(os.environ.get("MAX_BATCH_JOBS", 500))
+# batches are kept as long as jobs may wait in the queue
+BATCH_TTL = 7 * 24 * 60 * 60
+# number of render workers, for the queue ETA
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 1))
+MAX_NUMBER_FRAMES = int(os.environ.get("MAX_NUMBER_FRAMES", -1))
+FRAME_TIME = 1.0 / float(os.environ.get("RENDER_FPS", 30))
+# admission control, 0 means no limit
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", 0))
+MAX_QUEUED_JOBS_PER_TOKEN = int(os.environ.get("MAX_QUEUED_JOBS_PER_TOKEN", 0))
+# suggested wait when no job has finished yet to estimate it from
+DEFAULT_RETRY_AFTER = 60
+# how often an event stream checks for new messages, and re-reads the job state in case it missed one
+EVENT_POLL_INTERVAL = 0.1
+EVENT_KEEPALIVE_INTERVAL = 15
+# the metrics recorded by the API; the workers export the job metrics themselves
+API_METRICS = {
+	"genea_queue_jobs": "Jobs waiting in the render queue.",
+	"genea_running_jobs": "Jobs being rendered.",
+	"genea_jobs_rejected_total": "Render requests turned away with a 429, by reason.",
+	"genea_api_transferred_bytes_total": "Bytes of uploads received and of files sent by the API.",
+	"genea_render_cache_hits_total": "Render requests answered from the render cache.",
+	"genea_render_cache_misses_total": "Render requests not found in the render cache.",
+	"genea_render_cache_entries": "Videos in the render cache.",
+	"genea_render_cache_bytes": "Size of the videos in the render cache.",
+	"genea_artifact_files": "Files in the artifact folder, including the work directories of the workers.",
+	"genea_artifact_bytes": "Size of the files in the artifact folder.",
+	"genea_artifact_free_bytes": "Free space on the artifact folder's file system.",
+}
+
+# scene levels of detail of the render script (create_scene.SCENE_PROFILES)
+SCENE_PROFILES = ("draft", "standard", "final")
+DEFAULT_PROFILE = "final"
+# camera views of the render script, the job's video is the first one requested
+VIEWS = ("main-agent", "interloctr", "dyadic")
+DEFAULT_VIEW = "main-agent"
+# states of a job whose frames are all rendered, but which is not finished yet
+RENDERED_STATES = {"COMBINING A/V"}
+
+# everything besides the uploads and the request parameters that changes the rendered video
+RENDER_SETTINGS = {
+	name: os.environ.get(name, "")
+	for name in ["RENDER_RESOLUTION_X", "RENDER_RESOLUTION_Y", "RENDER_FPS", "RENDER_DURATION_FRAMES", "RENDERER_VERSION", "BAKE_RETARGETING"]
+}
 
 
 celery_workers = Celery(
@@ -25,19 +92,54 @@ celery_workers = Celery(
 	broker=os.environ["CELERY_BROKER_URL"],
 	backend=os.environ["CELERY_RESULT_BACKEND"],
 )
+redis_client = redis.Redis.from_url(os.environ["CELERY_RESULT_BACKEND"])
+render_cache = RenderCache(
+	Path(os.environ.get("RENDER_CACHE_DIR", "/tmp/genea_visualizer_cache")),
+	int(os.environ.get("RENDER_CACHE_MAX_BYTES", 10 * 1024 ** 3)),
+	redis_client,
+)
 
 app = FastAPI()
 
 
-async def save_tmp_file(upload_file) -> str:
+async def save_tmp_file(upload_file, sha=None, max_bytes=MAX_UPLOAD_BYTES) -> str:
+	"""Streams an upload to disk in chunks, optionally feeding it to a hash on the way."""
 	_, extension = os.path.splitext(upload_file.filename)
 	filename = f"{uuid4()}{extension}"
-	(UPLOAD_FOLDER / filename).write_bytes(upload_file.file.read())
+	file = UPLOAD_FOLDER / filename
+	size = 0
+	try:
+		async with aiofiles.open(file, "wb") as f:
+			while True:
+				chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+				if not chunk:
+					break
+				size += len(chunk)
+				if size > max_bytes:
+					raise HTTPException(status_code=413, detail=f"{upload_file.filename} is larger than {max_bytes} bytes")
+				if sha is not None:
+					sha.update(chunk)
+				await f.write(chunk)
+	except BaseException:
+		file.unlink(missing_ok=True)
+		raise
+	finally:
+		await upload_file.close()
+	metrics.incr(redis_client, "genea_api_transferred_bytes_total", size, direction="received")
 	return f"/files/{filename}"
 
 
+def get_token(headers):
+	return headers.get("authorization", "")[7:]
+
+
+def token_owner(headers):
+	# jobs are owned by a digest of the token, which is all Redis gets to see
+	return hashlib.sha256(get_token(headers).encode("utf-8")).hexdigest()[:16]
+
+
 def verify_token(headers, path):
-	token = headers.get("authorization", "")[7:]
+	token = get_token(headers)
 	if os.environ["SYSTEM_TOKEN"] == token:
 		return True
 	elif not path.startswith("/upload_video") and os.environ["USER_TOKEN"] == token:
@@ -50,8 +152,88 @@ async def delete_tmp_file(file: Path):
 	file.unlink()
 
 
+def validate_wav_file(file: Path):
+	try:
+		wav_validation.validate_wav_file(file)
+	except wav_validation.WavValidationError as e:
+		raise HTTPException(status_code=400, detail=f"The supplied audio is not a usable WAV file ({e})")
+
+
+def check_profile(profile: str):
+	if profile not in SCENE_PROFILES:
+		raise HTTPException(status_code=400, detail=f"Unknown scene profile {profile!r}, use one of {', '.join(SCENE_PROFILES)}")
+
+
+def check_views(views: str) -> List[str]:
+	"""The comma-separated views of a request, without duplicates."""
+	view_list = list(dict.fromkeys(view.strip() for view in views.split(",") if view.strip()))
+	unknown = [view for view in view_list if view not in VIEWS]
+	if unknown or not view_list:
+		raise HTTPException(status_code=400, detail=f"Unknown views {', '.join(unknown) or views!r}, use some of {', '.join(VIEWS)}")
+	return view_list
+
+
+def render_cache_key(digests, p_rotate: str, visualization_mode: str, profile: str, preview: bool = False, view: str = DEFAULT_VIEW) -> str:
+	"""The cache key of a render, the same whether it came through /render or /render_batch."""
+	settings = dict(RENDER_SETTINGS, p_rotate=p_rotate, visualization_mode=visualization_mode, profile=profile, preview=preview, view=view)
+	return render_cache.key(digests, settings)
+
+
+def admit(owner: str, jobs: int = 1):
+	"""Raises a 429 when the queue, or the owner's share of it, has no room for this many more jobs."""
+	if MAX_QUEUE_DEPTH > 0 and render_queue.queued(redis_client) + jobs > MAX_QUEUE_DEPTH:
+		detail = f"The render queue is full ({MAX_QUEUE_DEPTH} jobs)" if jobs == 1 else f"The render queue has no room for {jobs} more jobs ({MAX_QUEUE_DEPTH} at most)"
+		reason = "queue_full"
+	elif MAX_QUEUED_JOBS_PER_TOKEN > 0 and render_queue.queued(redis_client, owner) + jobs > MAX_QUEUED_JOBS_PER_TOKEN:
+		detail = f"You already have {MAX_QUEUED_JOBS_PER_TOKEN} jobs in the queue" if jobs == 1 else f"{jobs} more jobs would take you over {MAX_QUEUED_JOBS_PER_TOKEN} jobs in the queue"
+		reason = "owner_limit"
+	else:
+		return
+	metrics.incr(redis_client, "genea_jobs_rejected_total", reason=reason)
+	# a slot frees up roughly whenever one of the workers finishes a job
+	mean_duration = render_queue.mean_duration(redis_client)
+	retry_after = math.ceil(mean_duration / RENDER_WORKERS) if mean_duration is not None else DEFAULT_RETRY_AFTER
+	raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+def file_path(file_uri: str) -> Path:
+	return artifact_store.path(file_uri)
+
+
+def delete_files(*file_uris):
+	for file_uri in file_uris:
+		if file_uri is not None:
+			file_path(file_uri).unlink(missing_ok=True)
+
+
+def cached_job(video: Path, metadata: dict) -> str:
+	"""Stores an already successful job serving a copy of a cached video."""
+	filename = f"{uuid4()}.mp4"
+	link_or_copy(video, UPLOAD_FOLDER / filename)
+	task_id = str(uuid4())
+	result = {"file": f"/files/{filename}", "metadata": dict(metadata, cached=True)}
+	celery_workers.backend.store_result(task_id, result, states.SUCCESS)
+	return task_id
+
+
+def artifact_usage():
+	"""(number of files, bytes) under the artifact folder."""
+	files = 0
+	size = 0
+	for folder, _, file_names in os.walk(UPLOAD_FOLDER):
+		for file_name in file_names:
+			try:
+				size += os.path.getsize(os.path.join(folder, file_name))
+				files += 1
+			except FileNotFoundError:
+				pass
+	return files, size
+
+
 async def remove_old_tmp_files():
 	for file in UPLOAD_FOLDER.glob("*"):
+		if not file.is_file():
+			continue
 		time_delta = datetime.now() - datetime.fromtimestamp(os.path.getmtime(file))
 		if time_delta.days > 0:
 			file.unlink()
@@ -61,45 +243,315 @@ async def remove_old_tmp_files():
 async def authorize(request: Request, call_next):
 	if not verify_token(request.headers, request.scope["path"]):
 		return JSONResponse(status_code=401)
+	# reject oversized requests before their body is spooled to disk
+	max_bytes = MAX_BATCH_BYTES + UPLOAD_CHUNK_SIZE if request.scope["path"] == "/render_batch" else MAX_REQUEST_BYTES
+	try:
+		content_length = int(request.headers.get("content-length", 0))
+	except ValueError:
+		return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length header"})
+	if content_length > max_bytes:
+		return JSONResponse(status_code=413, content={"detail": "Request too large"})
 	return await call_next(request)
 
 
 @app.post("/render", response_class=PlainTextResponse)
-async def render(p_rotate: str, visualization_mode: str, background_tasks: BackgroundTasks, bvh_file: UploadFile = File(...), audio_file: Optional[UploadFile] = File(None)):
-	bvh_file_uri = await save_tmp_file(bvh_file)
+async def render(p_rotate: str, visualization_mode: str, request: Request, background_tasks: BackgroundTasks, bvh_file: UploadFile = File(...), audio_file: Optional[UploadFile] = File(None), profile: str = DEFAULT_PROFILE, preview: bool = False, views: str = DEFAULT_VIEW):
+	"""Queues a render; with preview, a quick low-quality one to check the motion before the full render.
+
+	views is a comma-separated list of camera views, each rendered into its own video; the
+	first one is the job's video, the others are listed in its metadata.
+	"""
+	check_profile(profile)
+	view_list = check_views(views)
+	bvh_sha = hashlib.sha256()
+	bvh_file_uri = await save_tmp_file(bvh_file, bvh_sha)
 	audio_file_uri = None
+	audio_sha = None
 	if audio_file is not None:
-		audio_file_uri = await save_tmp_file(audio_file)
-	task = celery_workers.send_task("tasks.render", args=[bvh_file_uri, audio_file_uri, p_rotate, visualization_mode], kwargs={})
+		audio_sha = hashlib.sha256()
+		try:
+			audio_file_uri = await save_tmp_file(audio_file, audio_sha)
+		except HTTPException:
+			delete_files(bvh_file_uri)
+			raise
 	background_tasks.add_task(remove_old_tmp_files)
+
+	# bad files are turned away here rather than failing once they reach a worker
+	try:
+		await run_in_threadpool(validate_bvh_file, file_path(bvh_file_uri), MAX_NUMBER_FRAMES, FRAME_TIME)
+		if audio_file_uri is not None:
+			validate_wav_file(file_path(audio_file_uri))
+	except BvhValidationError as e:
+		delete_files(bvh_file_uri, audio_file_uri)
+		raise HTTPException(status_code=400, detail=str(e))
+	except HTTPException:
+		delete_files(bvh_file_uri, audio_file_uri)
+		raise
+
+	digests = [bvh_sha.digest(), audio_sha.digest() if audio_sha else None]
+	# only single-view jobs are cached, the cache keeps one video per job
+	cache_key = render_cache_key(digests, p_rotate, visualization_mode, profile, preview, view_list[0]) if len(view_list) == 1 else None
+	cached = render_cache.get(cache_key) if cache_key is not None else None
+	if cached is not None:
+		delete_files(bvh_file_uri, audio_file_uri)
+		return f"/jobid/{cached_job(*cached)}"
+
+	owner = token_owner(request.headers)
+	try:
+		admit(owner)
+	except HTTPException:
+		delete_files(bvh_file_uri, audio_file_uri)
+		raise
+
+	# queued before it is sent, so that a worker starting it right away finds it
+	task_id = str(uuid4())
+	render_queue.enqueue(redis_client, task_id, owner)
+	task = celery_workers.send_task("tasks.render", args=[bvh_file_uri, audio_file_uri, p_rotate, visualization_mode], kwargs={"cache_key": cache_key, "profile": profile, "preview": preview, "views": view_list if view_list != [DEFAULT_VIEW] else None}, task_id=task_id)
 	return f"/jobid/{task.id}"
 
 
 @app.get("/jobid/{task_id}")
 def check_job(task_id: str) -> str:
 	res = celery_workers.AsyncResult(task_id)
+	metadata = None
 	if res.state == states.PENDING:
-		reserved_tasks = celery_workers.control.inspect().reserved()
-		tasks = []
-		if reserved_tasks:
-			tasks_per_worker = reserved_tasks.values()
-			tasks = [item for sublist in tasks_per_worker for item in sublist]
-			found = False
-			for task in tasks:
-				if task["id"] == task_id:
-					found = True
-		result = {"jobs_in_queue": len(tasks)}
+		result = render_queue.status(redis_client, task_id, RENDER_WORKERS)
 	elif res.state == states.FAILURE:
 		result = str(res.result)
+	elif res.state == states.SUCCESS and isinstance(res.result, dict):
+		# the video URI stays in "result" so that existing clients keep working
+		result = res.result["file"]
+		metadata = res.result["metadata"]
+		video = file_path(result)
+		if "cache_key" in metadata and not metadata.get("cached") and video.exists():
+			render_cache.put(metadata["cache_key"], video, metadata)
 	else:
 		result = res.result
+	if metadata is not None:
+		return {"state": res.state, "result": result, "metadata": metadata}
 	return {"state": res.state, "result": result}
 
 
+@app.get("/jobid/{task_id}/events")
+async def job_events_stream(task_id: str, request: Request):
+	"""Streams the job's state changes as server-sent events, until it succeeds or fails."""
+	pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+	pubsub.subscribe(job_events.channel(task_id))
+
+	async def events():
+		try:
+			# subscribed before the first read, so that nothing falls in between
+			status = await run_in_threadpool(check_job, task_id)
+			yield f"data: {json.dumps(status)}\n\n"
+			last_check = asyncio.get_event_loop().time()
+			while status["state"] not in job_events.FINAL_STATES:
+				if await request.is_disconnected():
+					return
+				message = pubsub.get_message()
+				now = asyncio.get_event_loop().time()
+				if message is not None:
+					status = job_events.parse(message)
+					if status["state"] in job_events.FINAL_STATES:
+						# the full response, with the video URI and metadata
+						status = await run_in_threadpool(check_job, task_id)
+					yield f"data: {json.dumps(status)}\n\n"
+				elif now - last_check > EVENT_KEEPALIVE_INTERVAL:
+					status = await run_in_threadpool(check_job, task_id)
+					last_check = now
+					yield f"data: {json.dumps(status)}\n\n"
+				else:
+					await asyncio.sleep(EVENT_POLL_INTERVAL)
+		finally:
+			pubsub.close()
+
+	return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def batch_key(batch_id: str) -> str:
+	return f"genea:batch:{batch_id}"
+
+
+def validate_batch(items) -> Dict[str, int]:
+	"""Validates every pair of a batch, returns the number of frames of each."""
+	frames = {}
+	errors = []
+	for name, item in sorted(items.items()):
+		try:
+			frames[name] = validate_bvh_file(item["bvh"][0], MAX_NUMBER_FRAMES, FRAME_TIME)
+			if "audio" in item:
+				validate_wav_file(item["audio"][0])
+		except BvhValidationError as e:
+			errors.append(f"{name}: {e}")
+		except HTTPException as e:
+			errors.append(f"{name}: {e.detail}")
+	if errors:
+		raise HTTPException(status_code=400, detail=errors)
+	return frames
+
+
+@app.post("/render_batch", response_class=PlainTextResponse)
+async def render_batch(p_rotate: str, visualization_mode: str, request: Request, background_tasks: BackgroundTasks, archive: UploadFile = File(...), profile: str = DEFAULT_PROFILE):
+	"""Renders every BVH file (with the WAV file of the same name, if any) of a zip or tar archive."""
+	check_profile(profile)
+	owner = token_owner(request.headers)
+	# turns the batch away before its upload when not even one more job fits
+	admit(owner)
+	archive_uri = await save_tmp_file(archive, max_bytes=MAX_BATCH_BYTES)
+	background_tasks.add_task(remove_old_tmp_files)
+	try:
+		items = await run_in_threadpool(extract_batch, file_path(archive_uri), UPLOAD_FOLDER, MAX_UPLOAD_BYTES, MAX_BATCH_JOBS)
+	except BatchArchiveError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+	finally:
+		delete_files(archive_uri)
+	try:
+		frames = await run_in_threadpool(validate_batch, items)
+	except HTTPException:
+		delete_batch_files(items)
+		raise
+
+	jobs = []
+	signatures = []
+	uncached = {}
+	# the longest renders are queued first, so that the batch does not end waiting on one of them
+	for name in sorted(items, key=lambda name: frames[name], reverse=True):
+		bvh_file, bvh_digest = items[name]["bvh"]
+		audio_file, audio_digest = items[name].get("audio", (None, None))
+		cache_key = render_cache_key([bvh_digest, audio_digest], p_rotate, visualization_mode, profile)
+		cached = render_cache.get(cache_key)
+		if cached is not None:
+			delete_batch_files({name: items[name]})
+			job_id = cached_job(*cached)
+		else:
+			job_id = str(uuid4())
+			uncached[name] = items[name]
+			args = [artifact_store.uri(bvh_file), artifact_store.uri(audio_file) if audio_file else None, p_rotate, visualization_mode]
+			signatures.append(celery_workers.signature("tasks.render", args=args, kwargs={"cache_key": cache_key, "profile": profile}, task_id=job_id))
+		jobs.append({"name": name, "job_id": job_id, "frames": frames[name]})
+
+	# every job that is not cached takes a slot of the queue and of the owner's share
+	if signatures:
+		try:
+			admit(owner, len(signatures))
+		except HTTPException:
+			delete_batch_files(uncached)
+			raise
+
+	batch_id = str(uuid4())
+	redis_client.set(batch_key(batch_id), json.dumps({"jobs": jobs}), ex=BATCH_TTL)
+	if signatures:
+		for signature in signatures:
+			render_queue.enqueue(redis_client, signature.options["task_id"], owner)
+		group(signatures, app=celery_workers).apply_async()
+	return f"/batch/{batch_id}"
+
+
+def load_batch(batch_id: str) -> dict:
+	batch = redis_client.get(batch_key(batch_id))
+	if batch is None:
+		raise HTTPException(status_code=404, detail="Unknown batch")
+	return json.loads(batch)
+
+
+@app.get("/batch/{batch_id}")
+def check_batch(batch_id: str) -> dict:
+	"""The aggregate state of a batch, with the frames rendered so far over all of its jobs."""
+	batch = load_batch(batch_id)
+	jobs = []
+	current = 0
+	total = 0
+	done = 0
+	failed = 0
+	for job in batch["jobs"]:
+		status = check_job(job["job_id"])
+		state = status["state"]
+		if state == states.SUCCESS:
+			progress = 1
+			done += 1
+		elif state in states.READY_STATES:
+			progress = 1
+			failed += 1
+		elif state == "RENDERING":
+			progress = status["result"]["current"] / max(status["result"]["total"], 1)
+		elif state in RENDERED_STATES:
+			progress = 1
+		else:
+			progress = 0
+		current += round(job["frames"] * min(progress, 1))
+		total += job["frames"]
+		jobs.append({"name": job["name"], "job": f"/jobid/{job['job_id']}", "state": state})
+
+	result = {"current": current, "total": total, "jobs_done": done, "jobs_failed": failed, "jobs_total": len(jobs)}
+	if done + failed < len(jobs):
+		state = "PENDING" if current == 0 and all(job["state"] == states.PENDING for job in jobs) else "RENDERING"
+	elif done == 0:
+		state = states.FAILURE
+	else:
+		# finished, possibly with some failed jobs, which the archive lists
+		state = states.SUCCESS
+		result["archive"] = f"/batch/{batch_id}/archive"
+	return {"state": state, "result": result, "jobs": jobs}
+
+
+@app.get("/batch/{batch_id}/archive")
+async def batch_archive(batch_id: str, background_tasks: BackgroundTasks):
+	"""A zip of all the rendered videos of a finished batch. Like /files, it can be downloaded once."""
+	batch = await run_in_threadpool(load_batch, batch_id)
+	videos = []
+	failures = {}
+	for job in batch["jobs"]:
+		status = await run_in_threadpool(check_job, job["job_id"])
+		if status["state"] == states.SUCCESS:
+			video = file_path(status["result"])
+			if video.exists():
+				videos.append((job["name"], video))
+			else:
+				failures[job["name"]] = "The video has already been downloaded"
+		elif status["state"] in states.READY_STATES:
+			failures[job["name"]] = str(status["result"])
+		else:
+			raise HTTPException(status_code=409, detail="The batch is not finished yet")
+
+	archive = UPLOAD_FOLDER / f"{uuid4()}.zip"
+	await run_in_threadpool(write_outputs_archive, archive, videos, failures)
+	for file in [archive] + [video for _, video in videos]:
+		background_tasks.add_task(delete_tmp_file, file)
+	metrics.incr(redis_client, "genea_api_transferred_bytes_total", archive.stat().st_size, direction="sent")
+	return FileResponse(str(archive), filename=f"batch_{batch_id}.zip")
+
+
+@app.get("/cache_stats")
+def cache_stats() -> dict:
+	return render_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+	"""The API's metrics in the Prometheus text format. Job latencies, stage timings,
+	frames rendered and failures are exported by the workers."""
+	cache_stats = render_cache.stats()
+	files, size = artifact_usage()
+	computed = [
+		("genea_queue_jobs", "gauge", {}, render_queue.queued(redis_client)),
+		("genea_running_jobs", "gauge", {}, render_queue.running(redis_client)),
+		("genea_render_cache_hits_total", "counter", {}, cache_stats["hits"]),
+		("genea_render_cache_misses_total", "counter", {}, cache_stats["misses"]),
+		("genea_render_cache_entries", "gauge", {}, cache_stats["entries"]),
+		("genea_render_cache_bytes", "gauge", {}, cache_stats["bytes"]),
+		("genea_artifact_files", "gauge", {"folder": str(UPLOAD_FOLDER)}, files),
+		("genea_artifact_bytes", "gauge", {"folder": str(UPLOAD_FOLDER)}, size),
+		("genea_artifact_free_bytes", "gauge", {"folder": str(UPLOAD_FOLDER)}, shutil.disk_usage(UPLOAD_FOLDER).free),
+	]
+	body = metrics.exposition(redis_client, API_METRICS, computed, API_METRICS)
+	return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/files/{file_name}")
 async def files(file_name, background_tasks: BackgroundTasks):
 	file = UPLOAD_FOLDER / file_name
 	background_tasks.add_task(delete_tmp_file, file)
+	if file.is_file():
+		metrics.incr(redis_client, "genea_api_transferred_bytes_total", file.stat().st_size, direction="sent")
 	return FileResponse(str(file))
 
 
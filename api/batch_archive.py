@@ -0,0 +1,106 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+import hashlib
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Tuple
+from uuid import uuid4
+
+COPY_CHUNK_SIZE = 1024 * 1024
+BATCH_EXTENSIONS = {".bvh": "bvh", ".wav": "audio"}
+
+
+class BatchArchiveError(ValueError):
+	pass
+
+
+def archive_members(archive: Path):
+	"""Yields (name, size, open) for the regular files of a zip or tar archive."""
+	if zipfile.is_zipfile(archive):
+		with zipfile.ZipFile(archive) as zf:
+			for info in zf.infolist():
+				if not info.is_dir():
+					yield info.filename, info.file_size, lambda info=info: zf.open(info)
+	elif tarfile.is_tarfile(str(archive)):
+		with tarfile.open(str(archive)) as tf:
+			for member in tf:
+				if member.isfile():
+					yield member.name, member.size, lambda member=member: tf.extractfile(member)
+	else:
+		raise BatchArchiveError("The batch is neither a zip nor a tar archive")
+
+
+def copy_with_digest(source, destination: Path, max_bytes: int) -> bytes:
+	sha = hashlib.sha256()
+	size = 0
+	try:
+		with destination.open("wb") as f:
+			for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+				size += len(chunk)
+				if size > max_bytes:
+					raise BatchArchiveError(f"{destination.name} is larger than {max_bytes} bytes")
+				sha.update(chunk)
+				f.write(chunk)
+	except BaseException:
+		destination.unlink(missing_ok=True)
+		raise
+	return sha.digest()
+
+
+def extract_batch(archive: Path, folder: Path, max_bytes: int, max_items: int) -> Dict[str, Dict[str, Tuple[Path, bytes]]]:
+	"""Extracts the BVH and WAV files of an archive into folder, under new names.
+
+	Files are paired by their path without extension ("take1/a.bvh" with "take1/a.wav"),
+	and returned as {name: {"bvh" or "audio": (path, sha256 digest)}}. Every extracted
+	file is removed again if the archive turns out to be unusable.
+	"""
+	items = {}
+	try:
+		for member_name, size, open_member in archive_members(archive):
+			path = PurePosixPath(member_name)
+			kind = BATCH_EXTENSIONS.get(path.suffix.lower())
+			if kind is None or any(part.startswith(".") or part == "__MACOSX" for part in path.parts):
+				continue
+			if size > max_bytes:
+				raise BatchArchiveError(f"{member_name} is larger than {max_bytes} bytes")
+			name = str(path.with_suffix(""))
+			if name not in items and len(items) >= max_items:
+				raise BatchArchiveError(f"The batch has more than {max_items} BVH/WAV pairs")
+			destination = folder / f"{uuid4()}{path.suffix.lower()}"
+			item = items.setdefault(name, {})
+			with open_member() as source:
+				item[kind] = (destination, copy_with_digest(source, destination, max_bytes))
+	except (BatchArchiveError, zipfile.BadZipFile, tarfile.TarError, OSError) as e:
+		delete_batch_files(items)
+		if isinstance(e, BatchArchiveError):
+			raise
+		raise BatchArchiveError(f"The batch archive could not be read ({e})")
+
+	missing_bvh = [name for name, item in items.items() if "bvh" not in item]
+	if missing_bvh or not items:
+		delete_batch_files(items)
+		if not items:
+			raise BatchArchiveError("The batch archive has no BVH files")
+		raise BatchArchiveError(f"No BVH file for the audio of {', '.join(sorted(missing_bvh))}")
+	return items
+
+
+def delete_batch_files(items):
+	for item in items.values():
+		for path, _ in item.values():
+			path.unlink(missing_ok=True)
+
+
+def write_outputs_archive(destination: Path, videos: List[Tuple[str, Path]], failures: Dict[str, str]):
+	"""Zips the rendered videos, stored without compression as MP4 is compressed already."""
+	with zipfile.ZipFile(destination, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+		for name, video in videos:
+			zf.write(video, f"{name}.mp4")
+		if failures:
+			zf.writestr("failures.txt", "".join(f"{name}: {error}\n" for name, error in sorted(failures.items())))
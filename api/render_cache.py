@@ -0,0 +1,99 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from artifact_store import link_or_copy
+
+
+class RenderCache:
+	"""Rendered videos on disk, keyed on a hash of the uploaded files and every render setting.
+
+	The least recently used videos are evicted once the cache grows beyond max_bytes
+	(0 disables the cache). Hit and miss counters live in Redis so that all API
+	workers share them.
+	"""
+
+	def __init__(self, folder: Path, max_bytes: int, redis):
+		self.folder = folder
+		self.max_bytes = max_bytes
+		self.redis = redis
+		self.folder.mkdir(parents=True, exist_ok=True)
+
+	@property
+	def enabled(self) -> bool:
+		return self.max_bytes > 0
+
+	def key(self, digests: List[Optional[bytes]], settings: Dict[str, str]) -> str:
+		"""Combines the sha256 digests of the uploaded files (None for a missing file) with the settings."""
+		sha = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+		for digest in digests:
+			sha.update(b"\0" if digest is None else digest)
+		return sha.hexdigest()
+
+	def video_path(self, key: str) -> Path:
+		return self.folder / f"{key}.mp4"
+
+	def metadata_path(self, key: str) -> Path:
+		return self.folder / f"{key}.json"
+
+	def get(self, key: str):
+		"""Returns (video path, metadata) for a cached render, or None."""
+		if not self.enabled:
+			return None
+		video = self.video_path(key)
+		try:
+			os.utime(video)  # the modification time orders the LRU eviction
+			metadata = json.loads(self.metadata_path(key).read_text())
+		except (OSError, ValueError):
+			self.redis.incr("genea:render_cache:misses")
+			return None
+		self.redis.incr("genea:render_cache:hits")
+		return video, metadata
+
+	def put(self, key: str, video: Path, metadata: dict):
+		if not self.enabled or self.video_path(key).exists():
+			return
+		tmp_video = self.folder / f"{key}.{os.getpid()}.tmp"
+		link_or_copy(video, tmp_video)
+		self.metadata_path(key).write_text(json.dumps(metadata))
+		os.replace(tmp_video, self.video_path(key))
+		self.evict()
+
+	def entries(self):
+		entries = []
+		for video in self.folder.glob("*.mp4"):
+			try:
+				stat = video.stat()
+			except FileNotFoundError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, video))
+		return entries
+
+	def evict(self):
+		entries = sorted(self.entries())
+		total = sum(size for _, size, _ in entries)
+		for _, size, video in entries:
+			if total <= self.max_bytes:
+				break
+			video.unlink(missing_ok=True)
+			video.with_suffix(".json").unlink(missing_ok=True)
+			total -= size
+
+	def stats(self) -> dict:
+		entries = self.entries()
+		return {
+			"hits": int(self.redis.get("genea:render_cache:hits") or 0),
+			"misses": int(self.redis.get("genea:render_cache:misses") or 0),
+			"entries": len(entries),
+			"bytes": sum(size for _, size, _ in entries),
+			"max_bytes": self.max_bytes,
+		}
@@ -0,0 +1,75 @@
+# Micro-benchmark of the speech bubble audio envelope (edit_audio.get_volume_strided).
+#
+# Compares the vectorized envelope with the original per-sample path
+# (get_volume for every frame) and checks that both return the same values.
+# Without a WAV file, a 10-minute 44.1 kHz mono noise file is synthesized.
+
+import argparse
+import io
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "celery-queue" / "scripts"))
+import edit_audio
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("wav_file", nargs="?", type=Path, help="A WAV file to benchmark on, e.g. a full-length GENEA recording.")
+parser.add_argument("--minutes", type=float, default=10, help="Length of the synthesized WAV file when no file is given.")
+parser.add_argument("--fps", type=int, default=30, help="The video frame rate the envelope is computed for.")
+args = parser.parse_args()
+
+
+def synthesize_wav(minutes, rate=44100):
+	rng = np.random.default_rng(0)
+	samples = (rng.standard_normal(int(minutes * 60 * rate)) * 4000).clip(-32768, 32767).astype(np.int16)
+	buffer = io.BytesIO()
+	with wave.open(buffer, "wb") as wav:
+		wav.setnchannels(1)
+		wav.setsampwidth(2)
+		wav.setframerate(rate)
+		wav.writeframes(samples.tobytes())
+	buffer.seek(0)
+	return buffer
+
+
+def open_wav():
+	if args.wav_file:
+		return wave.open(str(args.wav_file), "rb")
+	return wave.open(synthesize_wav(args.minutes), "rb")
+
+
+# the original get_volume_strided, one get_volume (about 20 seeks) per frame
+def reference_volume_strided(audio, stride, start, stop):
+	times = []
+	v = start
+	i = 0
+	while v < stop:
+		v = start + stride * i
+		times.append(v)
+		i += 1
+	return [edit_audio.get_volume(audio, t) for t in times]
+
+
+audio = open_wav()
+duration = audio.getnframes() / audio.getframerate()
+print(f"{duration:.1f} s of audio, {audio.getframerate()} Hz, {audio.getnchannels()} channel(s)")
+
+start = time.perf_counter()
+reference = reference_volume_strided(audio, 1 / args.fps, 0, duration)
+reference_time = time.perf_counter() - start
+
+audio = open_wav()
+start = time.perf_counter()
+vectorized = edit_audio.get_volume_strided(audio, 1 / args.fps, -1, -1)
+vectorized_time = time.perf_counter() - start
+
+assert len(reference) == len(vectorized), "the envelopes have different lengths"
+assert np.array_equal(np.array(reference, dtype=np.int16), vectorized), "the envelopes differ"
+
+print(f"per-sample reads: {reference_time:8.3f} s")
+print(f"vectorized:       {vectorized_time:8.3f} s")
+print(f"speed-up:         {reference_time / vectorized_time:8.1f}x ({len(vectorized)} frames, identical values)")
@@ -0,0 +1,93 @@
+# Benchmark of the BVH upload validation.
+#
+# Compares the original validate_bvh_file (a full bvh.Bvh parse plus a second split of
+# the text) with the single-pass validator in common/bvh_validation.py, on synthesized
+# files of the GENEA skeleton's size, and checks that both accept and reject the same
+# files with the same messages.
+#
+# The original validator needs the bvh package, which the API and the workers no longer
+# install: pip install -r benchmarks/requirements.txt
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from bvh import Bvh
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+import bvh_validation
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--frames", type=int, nargs="+", default=[3600, 36000], help="Lengths of the synthesized files.")
+parser.add_argument("--joints", type=int, default=75, help="Number of joints in the synthesized skeleton.")
+parser.add_argument("--fps", type=int, default=30)
+args = parser.parse_args()
+
+
+def synthesize_bvh(frames, joints, frame_time=None, rows=None):
+	lines = ["HIERARCHY", "ROOT Hips", "{", "\tOFFSET 0.0 0.0 0.0", "\tCHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation"]
+	for joint in range(1, joints):
+		lines += [f"{chr(9) * joint}JOINT Joint{joint}", f"{chr(9) * joint}{{", f"{chr(9) * (joint + 1)}OFFSET 0.0 10.0 0.0", f"{chr(9) * (joint + 1)}CHANNELS 3 Zrotation Xrotation Yrotation"]
+	lines += [f"{chr(9) * joints}End Site", f"{chr(9) * joints}{{", f"{chr(9) * (joints + 1)}OFFSET 0.0 10.0 0.0", f"{chr(9) * joints}}}"]
+	lines += [f"{chr(9) * joint}}}" for joint in reversed(range(joints))]
+	lines += ["MOTION", f"Frames: {frames}", f"Frame Time: {frame_time or 1 / args.fps:.6f}"]
+	row = " ".join(f"{value * 0.123456:.6f}" for value in range(6 + 3 * (joints - 1)))
+	lines += [row] * (frames if rows is None else rows)
+	return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# the original validate_bvh_file from tasks.py
+def reference_validate(bvh_file, max_frames, frame_time, frame_epsilon=bvh_validation.FRAME_EPSILON):
+	file_content = bvh_file.decode("utf-8")
+	mocap = Bvh(file_content)
+	counter = None
+	for line in file_content.split("\n"):
+		if counter is not None and line.strip():
+			counter += 1
+		if line.strip() == "MOTION":
+			counter = -2
+	if mocap.nframes != counter:
+		raise ValueError(f"The number of rows with motion data ({counter}) does not match the Frames field ({mocap.nframes})")
+	if max_frames != -1 and mocap.nframes > max_frames:
+		raise ValueError(f"The supplied number of frames ({mocap.nframes}) is bigger than {max_frames}")
+	if mocap.frame_time < frame_time - frame_epsilon or mocap.frame_time > frame_time + frame_epsilon:
+		raise ValueError(f"The supplied frame time ({mocap.frame_time}) differs from the required {frame_time} (+/- {frame_epsilon})")
+	return mocap.nframes
+
+
+def outcome(validate, data, max_frames):
+	try:
+		return validate(data, max_frames)
+	except ValueError as e:
+		return str(e)
+
+
+frame_time = 1.0 / args.fps
+validators = {
+	"bvh.Bvh + split": lambda data, max_frames: reference_validate(data, max_frames, frame_time),
+	"single pass": lambda data, max_frames: bvh_validation.validate_bvh(data.splitlines(True), max_frames, frame_time),
+}
+
+# each broken file has a single problem, so both report the same one
+cases = {
+	"missing rows": (synthesize_bvh(100, 5, rows=99), -1),
+	"too many frames": (synthesize_bvh(100, 5), 50),
+	"wrong frame time": (synthesize_bvh(100, 5, frame_time=1 / 60), -1),
+}
+for name, (data, max_frames) in cases.items():
+	results = {outcome(validate, data, max_frames) for validate in validators.values()}
+	assert len(results) == 1, f"{name}: {results}"
+	print(f"{name}: {results.pop()}")
+
+print(f"{'frames':>8} {'MB':>6} " + " ".join(f"{name:>16}" for name in validators) + f" {'speed-up':>9}")
+for frames in args.frames:
+	data = synthesize_bvh(frames, args.joints)
+	times = []
+	results = set()
+	for validate in validators.values():
+		start = time.perf_counter()
+		results.add(validate(data, -1))
+		times.append(time.perf_counter() - start)
+	assert results == {frames}, results
+	print(f"{frames:>8} {len(data) / 1e6:>6.1f} " + " ".join(f"{t:>15.3f}s" for t in times) + f" {times[0] / times[1]:>8.1f}x")
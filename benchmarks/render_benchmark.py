@@ -0,0 +1,288 @@
+# Render throughput benchmark of the Blender render scripts.
+#
+# Renders synthetic, seeded BVH/WAV fixtures (the same ones on every run) headless with
+# blender_render_2024.py and/or blender_render_2023.py at several durations and
+# resolutions, and writes a JSON report with the wall time, the script's stage timings
+# (2024 only), the peak RSS of Blender and the size of the video for every case. 2024 is
+# rendered at every scene profile of --profiles, to compare their render time per frame.
+#
+# With --baseline, the cases are compared with a stored report and the run fails when
+# one got slower (or bigger in memory) than the threshold allows; --save_baseline
+# stores the report as the new baseline. Only needs Blender and a CPU, e.g.
+#
+#   python benchmarks/render_benchmark.py --baseline benchmarks/baseline.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+QUEUE_DIR = Path(__file__).resolve().parents[1] / "celery-queue"
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--blender", default=os.environ.get("BLENDER_EXECUTABLE", "/blender/blender-2.83.0-linux64/blender"))
+parser.add_argument("--scripts", nargs="+", choices=["2024", "2023"], default=["2024"], help="The render scripts to benchmark.")
+parser.add_argument("--durations", type=int, nargs="+", default=[30, 300, 1800], help="Numbers of frames to render.")
+parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"], help="Video resolutions, as WIDTHxHEIGHT.")
+parser.add_argument("--fps", type=int, default=30)
+parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the report has the median.")
+parser.add_argument("--profiles", nargs="+", choices=["draft", "standard", "final"], default=["final"], help="Scene profiles to render 2024 at.")
+parser.add_argument("--views", nargs="+", choices=["main-agent", "interloctr", "dyadic"], default=["main-agent"], help="Camera views 2024 renders (several in one multiview pass).")
+parser.add_argument("--template", action="store_true", help="Render 2024 from the pre-baked scene template, as the workers do.")
+parser.add_argument("--bake", action="store_true", help="Render 2024 with the BVH motion baked into the characters' actions instead of bone constraints.")
+parser.add_argument("-o", "--output", type=Path, default=Path("render_benchmark.json"), help="Where the JSON report is written.")
+parser.add_argument("--baseline", type=Path, help="A previous report to compare with.")
+parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown (and RSS growth) against the baseline.")
+parser.add_argument("--save_baseline", action="store_true", help="Also write the report to --baseline.")
+parser.add_argument("--keep", type=Path, help="Keep the fixtures and videos in this directory instead of a temporary one.")
+args = parser.parse_args()
+
+# the joints the retargeting constrains, in the GENEA naming: (name, parent, offset in cm)
+SKELETON = [
+	("body_world", None, (0, 0, 0)),
+	("b_root", "body_world", (0, 95, 0)),
+	("b_spine0", "b_root", (0, 8, 0)),
+	("b_spine1", "b_spine0", (0, 10, 0)),
+	("b_spine2", "b_spine1", (0, 10, 0)),
+	("b_spine3", "b_spine2", (0, 10, 0)),
+	("b_neck0", "b_spine3", (0, 12, 0)),
+	("b_head", "b_neck0", (0, 10, 0)),
+	("b_l_shoulder", "b_spine3", (4, 8, 0)),
+	("b_l_arm", "b_l_shoulder", (14, 0, 0)),
+	("b_l_forearm", "b_l_arm", (28, 0, 0)),
+	("b_l_wrist", "b_l_forearm", (25, 0, 0)),
+	("b_r_shoulder", "b_spine3", (-4, 8, 0)),
+	("b_r_arm", "b_r_shoulder", (-14, 0, 0)),
+	("b_r_forearm", "b_r_arm", (-28, 0, 0)),
+	("b_r_wrist", "b_r_forearm", (-25, 0, 0)),
+	("b_l_upleg", "b_root", (9, -5, 0)),
+	("b_l_leg", "b_l_upleg", (0, -42, 0)),
+	("b_l_foot", "b_l_leg", (0, -40, 0)),
+	("b_r_upleg", "b_root", (-9, -5, 0)),
+	("b_r_leg", "b_r_upleg", (0, -42, 0)),
+	("b_r_foot", "b_r_leg", (0, -40, 0)),
+]
+
+
+def write_bvh(path, frames, fps, seed):
+	"""A gesturing skeleton: smooth, seeded sinusoids on every rotation channel."""
+	children = {}
+	for name, parent, _ in SKELETON:
+		children.setdefault(parent, []).append(name)
+	offsets = {name: offset for name, _, offset in SKELETON}
+	lines = ["HIERARCHY"]
+
+	def joint(name, depth):
+		indent = "\t" * depth
+		lines.append(f"{indent}{'ROOT' if depth == 0 else 'JOINT'} {name}")
+		lines.append(f"{indent}{{")
+		lines.append(f"{indent}\tOFFSET {' '.join(f'{value:.6f}' for value in offsets[name])}")
+		if depth == 0:
+			lines.append(f"{indent}\tCHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation")
+		else:
+			lines.append(f"{indent}\tCHANNELS 3 Zrotation Xrotation Yrotation")
+		for child in children.get(name, []):
+			joint(child, depth + 1)
+		if name not in children:
+			lines.append(f"{indent}\tEnd Site")
+			lines.append(f"{indent}\t{{")
+			lines.append(f"{indent}\t\tOFFSET 0.000000 5.000000 0.000000")
+			lines.append(f"{indent}\t}}")
+		lines.append(f"{indent}}}")
+
+	joint("body_world", 0)
+	rng = np.random.default_rng(seed)
+	t = np.arange(frames)[:, None] / fps
+	channels = 3 + 3 * len(SKELETON)
+	amplitudes = rng.uniform(2, 15, channels)
+	frequencies = rng.uniform(0.1, 1.0, channels)
+	phases = rng.uniform(0, 2 * math.pi, channels)
+	motion = amplitudes * np.sin(2 * math.pi * frequencies * t + phases)
+	motion[:, :3] *= 0.2  # the root drifts a little rather than walking away
+	lines.append("MOTION")
+	lines.append(f"Frames: {frames}")
+	lines.append(f"Frame Time: {1 / fps:.6f}")
+	path.write_text("\n".join(lines) + "\n" + "\n".join(" ".join(f"{value:.4f}" for value in row) for row in motion) + "\n")
+
+
+def write_wav(path, seconds, seed, rate=44100):
+	"""Noise in bursts of a few seconds, so that the speech bubbles turn on and off."""
+	rng = np.random.default_rng(seed)
+	samples = rng.standard_normal(int(seconds * rate)) * 4000
+	burst = (np.floor(np.arange(len(samples)) / (rate * rng.uniform(1.5, 3))) + seed) % 2
+	samples = (samples * burst).clip(-32768, 32767).astype(np.int16)
+	with wave.open(str(path), "wb") as wav:
+		wav.setnchannels(1)
+		wav.setsampwidth(2)
+		wav.setframerate(rate)
+		wav.writeframes(samples.tobytes())
+
+
+def fixtures(folder, frames):
+	"""The main agent and interlocutor BVH/WAV files of a duration, written once per run."""
+	files = {}
+	for role, seed in (("main", 1), ("intr", 2)):
+		bvh_file = folder / f"{role}_{frames}.bvh"
+		wav_file = folder / f"{role}_{frames}.wav"
+		if not bvh_file.exists():
+			write_bvh(bvh_file, frames, args.fps, seed)
+			write_wav(wav_file, frames / args.fps, seed)
+		files[role] = (bvh_file, wav_file)
+	return files
+
+
+def script_args(script, files, output_dir, frames, width, height, profile):
+	(main_bvh, main_wav), (intr_bvh, intr_wav) = files["main"], files["intr"]
+	script_args = [
+		"--input_main_bvh", main_bvh, "--input_intr_bvh", intr_bvh,
+		"--input_main_wav", main_wav, "--input_intr_wav", intr_wav,
+		"-o", output_dir, "--output_name", "benchmark",
+		# the script's frame range is inclusive
+		"--duration", frames - 1, "--video",
+		"--res_x", width, "--res_y", height,
+		"--visualization_mode", "full_body",
+	]
+	if script == "2024":
+		script_args += ["--profile", profile, "--views"] + args.views
+		if args.template:
+			script_args.append("--template")
+		if args.bake:
+			script_args.append("--bake")
+	return [str(arg) for arg in script_args]
+
+
+def run_case(script, files, output_dir, frames, width, height, profile):
+	"""One headless render: its wall time, stage timings, peak RSS and video size."""
+	command = [args.blender, "-b", "--python", f"blender_render_{script}.py", "--"] + script_args(script, files, output_dir, frames, width, height, profile)
+	start = time.perf_counter()
+	process = subprocess.Popen(command, cwd=str(QUEUE_DIR), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	stages = None
+	output_file = None
+	last_lines = []
+	for line in process.stdout:
+		line = line.decode("utf-8", errors="replace").strip()
+		last_lines = (last_lines + [line])[-20:]
+		if line.startswith("{"):
+			try:
+				event = json.loads(line)
+			except ValueError:
+				continue
+			if event.get("event") == "timings":
+				stages = event["stages"]
+			elif event.get("event") == "output_file":
+				output_file = event["path"]
+	# wait4 rather than wait, for the child's resource usage
+	_, status, usage = os.wait4(process.pid, 0)
+	process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+	process.stdout.close()
+	wall_seconds = time.perf_counter() - start
+	if output_file is None:
+		videos = sorted(Path(output_dir).glob("*.mp4"), key=os.path.getmtime)
+		output_file = str(videos[-1]) if videos else None
+	if process.returncode != 0 or output_file is None:
+		raise RuntimeError(f"blender_render_{script}.py failed:\n" + "\n".join(last_lines))
+	return {
+		"wall_seconds": wall_seconds,
+		"stages": stages,
+		# ru_maxrss is in KiB on Linux
+		"peak_rss_bytes": usage.ru_maxrss * 1024,
+		"output_bytes": os.path.getsize(output_file),
+	}
+
+
+def median_run(runs, frames):
+	"""The median of every number over the runs of a case."""
+	stages = None
+	render_seconds_per_frame = None
+	if runs[0]["stages"] is not None:
+		stages = {stage: statistics.median(run["stages"].get(stage, 0) for run in runs) for stage in runs[0]["stages"]}
+		render_seconds_per_frame = stages.get("render", 0) / frames
+	return {
+		"wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+		"stages": stages,
+		"render_seconds_per_frame": render_seconds_per_frame,
+		"peak_rss_bytes": statistics.median(run["peak_rss_bytes"] for run in runs),
+		"output_bytes": statistics.median(run["output_bytes"] for run in runs),
+		"runs": len(runs),
+	}
+
+
+def git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(QUEUE_DIR), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(report, baseline):
+	"""Prints every case against the baseline and returns the regressed ones."""
+	regressions = []
+	print(f"\n{'case':<36}{'wall':>10}{'baseline':>10}{'change':>9}{'rss MiB':>10}{'baseline':>10}")
+	for case, result in report["cases"].items():
+		base = baseline["cases"].get(case)
+		if base is None:
+			print(f"{case:<36}{result['wall_seconds']:>9.1f}s{'-':>10}")
+			continue
+		wall_change = result["wall_seconds"] / base["wall_seconds"] - 1
+		rss_change = result["peak_rss_bytes"] / base["peak_rss_bytes"] - 1
+		print(f"{case:<36}{result['wall_seconds']:>9.1f}s{base['wall_seconds']:>9.1f}s{wall_change:>+9.1%}{result['peak_rss_bytes'] / 2 ** 20:>10.0f}{base['peak_rss_bytes'] / 2 ** 20:>10.0f}")
+		if wall_change > args.threshold:
+			regressions.append(f"{case}: wall time {wall_change:+.1%}")
+		if rss_change > args.threshold:
+			regressions.append(f"{case}: peak RSS {rss_change:+.1%}")
+	return regressions
+
+
+work_dir = args.keep or Path(tempfile.mkdtemp(prefix="genea_render_benchmark_"))
+work_dir.mkdir(parents=True, exist_ok=True)
+report = {
+	"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+	"commit": git_commit(),
+	"platform": platform.platform(),
+	"cpus": os.cpu_count(),
+	"blender": args.blender,
+	"fps": args.fps,
+	"template": args.template,
+	"bake": args.bake,
+	"views": args.views,
+	"cases": {},
+}
+for frames in args.durations:
+	files = fixtures(work_dir, frames)
+	for resolution in args.resolutions:
+		width, height = (int(value) for value in resolution.split("x"))
+		# the 2023 script has no scene profiles
+		for script, profile in [(script, profile) for script in args.scripts for profile in (args.profiles if script == "2024" else [None])]:
+			case = f"{script}/{profile}/{frames}f/{width}x{height}" if profile else f"{script}/{frames}f/{width}x{height}"
+			runs = []
+			for run in range(args.repeat):
+				output_dir = work_dir / case.replace("/", "_") / str(run)
+				output_dir.mkdir(parents=True, exist_ok=True)
+				runs.append(run_case(script, files, output_dir, frames, width, height, profile))
+			result = report["cases"][case] = median_run(runs, frames)
+			print(f"{case}: {result['wall_seconds']:.1f} s ({frames / result['wall_seconds']:.1f} frames/s), peak RSS {result['peak_rss_bytes'] / 2 ** 20:.0f} MiB, {result['output_bytes'] / 2 ** 20:.1f} MiB video")
+			if result["stages"]:
+				print(f"  render {result['render_seconds_per_frame'] * 1000:.0f} ms/frame; " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stages"].items()))
+
+args.output.write_text(json.dumps(report, indent=1))
+print(f"Report written to {args.output}")
+
+if args.baseline and args.save_baseline:
+	args.baseline.write_text(json.dumps(report, indent=1))
+	print(f"Baseline written to {args.baseline}")
+elif args.baseline:
+	regressions = compare(report, json.loads(args.baseline.read_text()))
+	if regressions:
+		print(f"\nRegressions beyond {args.threshold:.0%}:\n" + "\n".join(regressions))
+		sys.exit(1)
+	print(f"\nNo regressions beyond {args.threshold:.0%}")
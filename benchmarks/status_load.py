@@ -0,0 +1,63 @@
+# Load test of the job status endpoint (/jobid/<id>).
+#
+# Runs an increasing number of concurrent pollers against a running server and
+# reports the latency percentiles at each level; with the Redis-backed queue
+# positions they should stay flat as the number of pollers grows. Unknown job ids
+# are PENDING to Celery, so by default every poll takes the queue-position path.
+
+import argparse
+import statistics
+import threading
+import time
+from uuid import uuid4
+
+import requests
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-s", "--server_url", default="http://localhost:5001")
+parser.add_argument("-t", "--token", default="j7HgTkwt24yKWfHPpFG3eoydJK6syAsz")
+parser.add_argument("-p", "--pollers", type=int, nargs="+", default=[1, 10, 50, 100, 200], help="Numbers of concurrent pollers to measure.")
+parser.add_argument("-d", "--seconds", type=float, default=20, help="How long each level runs.")
+parser.add_argument("-j", "--job_id", help="Poll this job instead of unknown (PENDING) ids.")
+args = parser.parse_args()
+
+headers = {"Authorization": f"Bearer {args.token}"}
+
+
+def poll(stop_at, latencies, errors):
+	session = requests.Session()
+	job_id = args.job_id or str(uuid4())
+	while time.perf_counter() < stop_at:
+		start = time.perf_counter()
+		try:
+			session.get(f"{args.server_url}/jobid/{job_id}", headers=headers, timeout=30).raise_for_status()
+		except requests.RequestException:
+			errors.append(1)
+			continue
+		latencies.append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+print(f"{'pollers':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+for pollers in args.pollers:
+	latencies = []
+	errors = []
+	stop_at = time.perf_counter() + args.seconds
+	threads = [threading.Thread(target=poll, args=(stop_at, latencies, errors)) for _ in range(pollers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	if not latencies:
+		print(f"{pollers:>8} no successful requests ({len(errors)} errors)")
+		continue
+	latencies.sort()
+	print(
+		f"{pollers:>8} {len(latencies) / args.seconds:>8.1f} {statistics.median(latencies) * 1000:>8.1f} "
+		f"{percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+		f"{latencies[-1] * 1000:>8.1f} {len(errors):>7}"
+	)
@@ -255,39 +255,20 @@ def main():
     framerate = bpy.context.scene.render.fps
     audio_proc1 = wave.open(os.path.abspath(ARG_MAIN_AUDIO_FILE), 'rb')
     audio_samples1 = edit_audio.get_volume_strided(audio_proc1, 1 / framerate, -1, -1)
-    audio_samples1 = [abs(x) / 32768 for x in audio_samples1] # normalize scale between 0 and 1
-    audio_samples1 = [x / max(audio_samples1) for x in audio_samples1] # normalize data between 0 and 1
-    audio_samples1 = [0 if x < 0.2 else 1 for x in audio_samples1]
-    audio_samples1 = edit_audio.smooth_kernel(audio_samples1, 10)
-    audio_samples1 = [max(0.0075, x * 0.05) for x in audio_samples1] # scale down and clamp to min
+    audio_samples1 = edit_audio.speech_activity(audio_samples1) # normalize, threshold, dilate, scale and clamp
     
     audio_proc2 = wave.open(os.path.abspath(ARG_INTR_AUDIO_FILE), 'rb')
     audio_samples2 = edit_audio.get_volume_strided(audio_proc2, 1 / framerate, -1, -1)
-    audio_samples2 = [abs(x) / 32768 for x in audio_samples2] # normalize scale between 0 and 1
-    audio_samples2 = [x / max(audio_samples2) for x in audio_samples2] # normalize data between 0 and 1
-    audio_samples2 = [0 if x < 0.2 else 1 for x in audio_samples2]
-    audio_samples2 = edit_audio.smooth_kernel(audio_samples2, 10)
-    audio_samples2 = [max(0.0075, x * 0.05) for x in audio_samples2] # scale down and clamp to min
+    audio_samples2 = edit_audio.speech_activity(audio_samples2) # normalize, threshold, dilate, scale and clamp
     
     if ARG_BUBBLE == True:
         bubble1 = create_scene.add_speechbubble(0.75)
         bubble2 = create_scene.add_speechbubble(-0.75)
         
-        for i in range(ARG_DURATION_IN_FRAMES):
-            start_frame = i * framerate
-            end_frame = (i + 1) * framerate
-            if i < len(audio_samples1):
-                a1s = audio_samples1[i]
-                a2s = audio_samples2[i]
-            else:
-                a1s = audio_samples1[-1]
-                a2s = audio_samples2[-1]
-            
-            bubble1.scale = (a1s, a1s, a1s)
-            bubble1.keyframe_insert(data_path='scale', frame=i)
-            
-            bubble2.scale = (a2s, a2s, a2s)
-            bubble2.keyframe_insert(data_path='scale', frame=i)
+        # key every frame up to the end of the rendered range, which may start past frame 0
+        bubble_frames = ARG_START_FRAME + ARG_DURATION_IN_FRAMES + 1
+        create_scene.animate_speechbubble(bubble1, audio_samples1, bubble_frames)
+        create_scene.animate_speechbubble(bubble2, audio_samples2, bubble_frames)
       
     # 05/04/2023 fix main camera orientation, fix character rotation and personal cameras
     if ARG_MODE == "full_body":     CAM_POS = [3.25, 0, 1.8]
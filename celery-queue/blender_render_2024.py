@@ -11,6 +11,9 @@ from pathlib import Path as myPath
 import wave
 import numpy as np
 import importlib
+import json
+import traceback
+from contextlib import contextmanager
 
 if bpy.ops.text.run_script.poll():
     script_dir = myPath(bpy.context.space_data.text.filepath).parents[0]
@@ -30,6 +33,27 @@ import edit_character
 importlib.reload(edit_character)
 import edit_audio
 importlib.reload(edit_audio)
+import scene_template
+importlib.reload(scene_template)
+
+# structured output for the worker driving the script: one JSON object per stdout line
+def emit_event(event, **fields):
+    print(json.dumps(dict(fields, event=event)), flush=True)
+
+# frames of the earlier render passes of the job, so that the progress runs on over all passes
+FRAME_OFFSET = 0
+
+def on_frame_written(scene, *args):
+    emit_event('frame', frame=scene.frame_current + FRAME_OFFSET)
+
+# adds the wall-clock time of the block to timings[stage]
+@contextmanager
+def timed(timings, stage):
+    stage_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - stage_start
 
 # cleans up the scene and memory
 def clear_scene():
@@ -57,10 +81,63 @@ def clear_scene():
 def create_sequencer():
     bpy.context.scene.sequence_editor_create()
     
-def render_video(output_dir, picture, video, filename_token, actor1, actor2, render_frame_start, render_frame_length, res_x, res_y):
-#    bpy.context.scene.render.engine = 'BLENDER_WORKBENCH'
-#    bpy.context.scene.display.shading.light = 'MATCAP'
-#    bpy.context.scene.display.render_aa = 'FXAA'
+# the views the script can render: their camera, and the actor hidden from it (None for both visible)
+def view_camera(view, actor1, actor2):
+    return {
+        'main-agent': (actor1 + '_cam', actor2),
+        'interloctr': (actor2 + '_cam', actor1),
+        'dyadic': ('Main_cam', None),
+    }[view]
+
+# moves the actor's mesh into a collection of its own, which a view layer can leave out
+def actor_collection(actor):
+    scene = bpy.context.scene
+    name = actor + '_mesh'
+    collection = bpy.data.collections.get(name)
+    if collection is None:
+        collection = bpy.data.collections.new(name)
+    if collection.name not in scene.collection.children:
+        scene.collection.children.link(collection)
+    mesh = bpy.data.objects[actor].children[1]
+    for other in list(mesh.users_collection):
+        if other != collection:
+            other.objects.unlink(mesh)
+    if mesh.name not in collection.objects:
+        collection.objects.link(mesh)
+    return collection
+
+# makes the view layer without the hidden actor (None for all actors) the only one rendered
+def use_view_layer(hidden_actor, actors):
+    scene = bpy.context.scene
+    name = 'Without_' + hidden_actor if hidden_actor else 'All_actors'
+    layer = scene.view_layers.get(name) or scene.view_layers.new(name)
+    for actor in actors:
+        collection = actor_collection(actor)
+        layer.layer_collection.children[collection.name].exclude = actor == hidden_actor
+    for other in scene.view_layers:
+        other.use = other == layer
+    scene.render.use_single_layer = False
+    return layer
+
+# a video dimension scaled by percent, kept even for H.264
+def scale_dimension(size, percent):
+    return max(2, int(round(size * percent / 200)) * 2)
+
+# renders the views into one video each, and returns {view: video file}
+def render_video(output_dir, picture, video, filename_token, actor1, actor2, render_frame_start, render_frame_length, res_x, res_y, preview=False, preview_scale=100, frame_step=1, views=('main-agent',)):
+    if preview:
+        # a quick look: flat matcap shading, smaller frames and only every frame_step-th frame,
+        # each held until the next one, so that the video keeps its length and the audio its sync
+        bpy.context.scene.render.engine = 'BLENDER_WORKBENCH'
+        bpy.context.scene.display.shading.light = 'MATCAP'
+        bpy.context.scene.display.render_aa = 'FXAA'
+        res_x = scale_dimension(res_x, preview_scale)
+        res_y = scale_dimension(res_y, preview_scale)
+        bpy.context.scene.frame_step = frame_step
+    else:
+        # a server without a template keeps the scene settings of its previous job
+        bpy.context.scene.render.engine = 'BLENDER_EEVEE'
+        bpy.context.scene.frame_step = 1
     bpy.context.scene.render.resolution_x=int(res_x)
     bpy.context.scene.render.resolution_y=int(res_y)
     bpy.context.scene.render.fps = 30
@@ -87,37 +164,55 @@ def render_video(output_dir, picture, video, filename_token, actor1, actor2, ren
         # bpy.context.scene.render.filepath=os.path.join(output_dir, '{}_interloctr_.png'.format(filename_token))
         # bpy.ops.render.render(write_still=True)
     
-    main_filepath = os.path.join(output_dir, '{}_main-agent.mp4'.format(filename_token))
-    # intr_filepath = os.path.join(output_dir, '{}_interloctr.mp4'.format(filename_token))
-    # dyad_filepath = os.path.join(output_dir, '{}_dyadic.mp4'.format(filename_token))
+    view_filepaths = {view: os.path.join(output_dir, '{}_{}.mp4'.format(filename_token, view)) for view in views}
     
     if video:
-        print(f"total_frames {render_frame_length}", flush=True)
         bpy.context.scene.render.image_settings.file_format='FFMPEG'
         bpy.context.scene.render.ffmpeg.format='MPEG4'
         bpy.context.scene.render.ffmpeg.codec = "H264"
         bpy.context.scene.render.ffmpeg.ffmpeg_preset='REALTIME'
         bpy.context.scene.render.ffmpeg.constant_rate_factor='HIGH'
-        bpy.context.scene.render.ffmpeg.audio_codec='MP3'
+        # the sound strips, if any, are muxed in by Blender while it encodes
+        has_sound = any(strip.type == 'SOUND' for strip in bpy.context.scene.sequence_editor.sequences_all)
+        bpy.context.scene.render.ffmpeg.audio_codec = 'AAC' if has_sound else 'NONE'
         bpy.context.scene.render.ffmpeg.gopsize = 30
-        create_camera.get_camera(actor1 + '_cam')
-        bpy.data.objects[actor1].children[1].hide_render = False
-        bpy.data.objects[actor2].children[1].hide_render = True
-        bpy.context.scene.render.filepath = main_filepath
-        bpy.ops.render.render(animation=True, write_still=True)
-        # create_camera.get_camera(actor2 + '_cam')
-        # bpy.data.objects[actor1].children[1].hide_render = True
-        # bpy.data.objects[actor2].children[1].hide_render = False
-        # bpy.context.scene.render.filepath = intr_filepath
-        # bpy.ops.render.render(animation=True, write_still=True)
-        # create_camera.get_camera('Main_cam')
-        # bpy.data.objects[actor1].children[1].hide_render = False
-        # bpy.data.objects[actor2].children[1].hide_render = False
-        # bpy.context.scene.render.filepath = dyad_filepath
-        # bpy.ops.render.render(animation=True, write_still=True)
-    return main_filepath
+        # an actor is hidden from a view through a view layer without it, and a frame renders one
+        # view layer for all views, so the views hiding the same actor share a multiview pass
+        passes = {}
+        for view in views:
+            camera, hidden_actor = view_camera(view, actor1, actor2)
+            passes.setdefault(hidden_actor, []).append((view, camera))
+        emit_event('total_frames', total=render_frame_length * len(passes))
+        global FRAME_OFFSET
+        for actor in (actor1, actor2):
+            bpy.data.objects[actor].children[1].hide_render = False
+        bpy.app.handlers.render_write.append(on_frame_written)
+        try:
+            for pass_index, (hidden_actor, pass_views) in enumerate(passes.items()):
+                FRAME_OFFSET = pass_index * render_frame_length
+                use_view_layer(hidden_actor, (actor1, actor2))
+                if len(pass_views) == 1:
+                    view, camera = pass_views[0]
+                    bpy.context.scene.render.use_multiview = False
+                    create_camera.get_camera(camera)
+                    bpy.context.scene.render.filepath = view_filepaths[view]
+                else:
+                    create_camera.setup_multiview(pass_views)
+                    # every view is written to its own file, with '_<view>' inserted before the extension
+                    bpy.context.scene.render.filepath = os.path.join(output_dir, '{}.mp4'.format(filename_token))
+                bpy.ops.render.render(animation=True, write_still=True)
+        finally:
+            FRAME_OFFSET = 0
+            bpy.app.handlers.render_write.remove(on_frame_written)
+    return view_filepaths
 
-def parse_args():
+def get_script_args():
+    argv = sys.argv
+    if "--" not in argv:
+        return []
+    return argv[argv.index("--") + 1 :]
+
+def parse_args(argv):
     parser = argparse.ArgumentParser(description="Some description.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-imb', '--input_main_bvh', help='Input filename of the main agent BVH motion file.', type=myPath, required=True)
     parser.add_argument('-iib', '--input_intr_bvh', help='Input filename of the interlocutor BVH motion file', type=myPath, required=True)
@@ -134,11 +229,16 @@ def parse_args():
     parser.add_argument('-rx', '--res_x', help='The horizontal resolution for the rendered videos.', type=int, default=1280)
     parser.add_argument('-ry', '--res_y', help='The vertical resolution for the rendered videos.', type=int, default=720)
     parser.add_argument('-sb', '--speechbubble', action='store_true', help='Visualize speaker bubble.')
-    argv = sys.argv
-    argv = argv[argv.index("--") + 1 :]
+    parser.add_argument('-t', '--template', action='store_true', help='Open the pre-baked scene template (built on first use) instead of building the static scene from scratch.')
+    parser.add_argument('--preview', action='store_true', help='Render a quick preview with Workbench matcap shading, at --preview_scale percent of the resolution and every --frame_step-th frame.')
+    parser.add_argument('--preview_scale', help='The resolution of a preview, in percent.', type=int, default=50)
+    parser.add_argument('--frame_step', help='A preview renders every this many frames.', type=int, default=3)
+    parser.add_argument('--views', nargs='+', help='The camera views to render, each into its own video; the views that show the same actors are rendered in a single animation pass.', choices=['main-agent', 'interloctr', 'dyadic'], default=['main-agent'])
+    parser.add_argument('--bake', action='store_true', help='Bake the BVH motion into an action on the characters and delete the BVH rigs, instead of evaluating bone constraints on every frame.')
+    parser.add_argument('--profile', help='The scene level of detail: "draft" and "standard" trade sky, speech bubble and texture detail for render time.', choices=list(create_scene.SCENE_PROFILES), type=str, default=create_scene.DEFAULT_PROFILE)
     return vars(parser.parse_args(args=argv))
 
-def main():
+def main(argv=None):
     IS_SERVER = "GENEA_SERVER" in os.environ
     if IS_SERVER:
         print('[INFO] Script is running inside a GENEA Docker environment.')
@@ -167,6 +267,13 @@ def main():
         ARG_RESOLUTION_Y = 720
         ARG_MODE = 'full_body'
         ARG_BUBBLE = True
+        ARG_TEMPLATE = False
+        ARG_PROFILE = 'final'
+        ARG_PREVIEW = False
+        ARG_PREVIEW_SCALE = 50
+        ARG_FRAME_STEP = 3
+        ARG_VIEWS = ['main-agent']
+        ARG_BAKE = False
         # might need to adjust output directory
         ARG_OUTPUT_DIR = SCRIPT_DIR / 'output/benchmarkUI'
         ARG_OUTPUT_NAME = "blender_output"
@@ -175,7 +282,7 @@ def main():
         print('[INFO] Script is running from command line.')
         SCRIPT_DIR = myPath(os.path.realpath(__file__)).parents[0]
         # process arguments
-        args = parse_args()
+        args = parse_args(argv if argv is not None else get_script_args())
         ARG_MAIN_BVH_FILE = args['input_main_bvh']
         ARG_INTR_BVH_FILE = args['input_intr_bvh']
         ARG_MAIN_AUDIO_FILE = args['input_main_wav'].resolve() if args['input_main_wav'] else None
@@ -189,6 +296,13 @@ def main():
         ARG_RESOLUTION_Y = args['res_y']
         ARG_MODE = args['visualization_mode']
         ARG_BUBBLE = args['speechbubble']
+        ARG_TEMPLATE = args['template']
+        ARG_PROFILE = args['profile']
+        ARG_PREVIEW = args['preview']
+        ARG_PREVIEW_SCALE = args['preview_scale']
+        ARG_FRAME_STEP = args['frame_step']
+        ARG_VIEWS = list(dict.fromkeys(args['views']))
+        ARG_BAKE = args['bake']
         # might need to adjust output directory
         ARG_OUTPUT_DIR = args['output_dir'].resolve() if args['output_dir'] else SCRIPT_DIR / 'output/'
         ARG_OUTPUT_NAME = args['output_name']
@@ -208,24 +322,47 @@ def main():
 
     start = time.time()
     
-    clear_scene()
-    
     OBJ1_friendly_name = 'OBJ1'
-    load_data.load_fbx(FBX_MODEL, OBJ1_friendly_name)
-    create_material.add_materials(SCRIPT_DIR, OBJ1_friendly_name)
-    load_data.load_bvh(str(ARG_MAIN_BVH_FILE))
-    edit_character.constraintBoneTargets(armature = OBJ1_friendly_name, rig = MAIN_BVH_NAME, mode = ARG_MODE)
-    
     OBJ2_friendly_name = 'OBJ2'
-    load_data.load_fbx(FBX_MODEL, OBJ2_friendly_name)
-    create_material.add_materials(SCRIPT_DIR, OBJ2_friendly_name)
-    load_data.load_bvh(str(ARG_INTR_BVH_FILE))
-    edit_character.constraintBoneTargets(armature = OBJ2_friendly_name, rig = INTR_BVH_NAME, mode = ARG_MODE)
+    timings = {}
+    if ARG_TEMPLATE:
+        # characters, materials, cameras, floor, light and sky come from the template
+        with timed(timings, 'template_open'):
+            template_hash = scene_template.open_template(SCRIPT_DIR, ARG_PROFILE)
+        emit_event('template_hash', hash=template_hash)
+    else:
+        with timed(timings, 'clear_scene'):
+            clear_scene()
+        with timed(timings, 'fbx_import'):
+            load_data.load_fbx(FBX_MODEL, OBJ1_friendly_name)
+            create_material.add_materials(SCRIPT_DIR, OBJ1_friendly_name, create_scene.SCENE_PROFILES[ARG_PROFILE]['texture_size'])
+            load_data.duplicate_fbx(OBJ1_friendly_name, OBJ2_friendly_name)
     
-    edit_character.setup_characters(MAIN_BVH_NAME, INTR_BVH_NAME)
+    if ARG_BAKE:
+        with timed(timings, 'bvh_import'):
+            rigs = [load_data.load_bvh(str(ARG_MAIN_BVH_FILE)), load_data.load_bvh(str(ARG_INTR_BVH_FILE))]
+        with timed(timings, 'bake'):
+            edit_character.setup_characters(MAIN_BVH_NAME, INTR_BVH_NAME)
+            edit_character.bakeBoneTargets(armature = OBJ1_friendly_name, rig = MAIN_BVH_NAME, mode = ARG_MODE)
+            edit_character.bakeBoneTargets(armature = OBJ2_friendly_name, rig = INTR_BVH_NAME, mode = ARG_MODE)
+            # the same file imported twice gets a ".001" rig, so the imported objects are removed rather than the names
+            for rig in rigs:
+                edit_character.remove_rig(rig.name)
+        MAIN_ACTION_OBJ, INTR_ACTION_OBJ = OBJ1_friendly_name, OBJ2_friendly_name
+    else:
+        with timed(timings, 'bvh_import'):
+            load_data.load_bvh(str(ARG_MAIN_BVH_FILE))
+        with timed(timings, 'constraints'):
+            edit_character.constraintBoneTargets(armature = OBJ1_friendly_name, rig = MAIN_BVH_NAME, mode = ARG_MODE)
+        
+        with timed(timings, 'bvh_import'):
+            load_data.load_bvh(str(ARG_INTR_BVH_FILE))
+        with timed(timings, 'constraints'):
+            edit_character.constraintBoneTargets(armature = OBJ2_friendly_name, rig = INTR_BVH_NAME, mode = ARG_MODE)
+            edit_character.setup_characters(MAIN_BVH_NAME, INTR_BVH_NAME)
+        MAIN_ACTION_OBJ, INTR_ACTION_OBJ = MAIN_BVH_NAME, INTR_BVH_NAME
     
     create_sequencer()
-    # for sanity, audio is handled using FFMPEG on the server and the input_audio argument should be ignored
     try:
         ARG_MAIN_AUDIO_FILE
     except:
@@ -236,91 +373,88 @@ def main():
     except:
         ARG_INTR_AUDIO_FILE = ''
     
-    if ARG_MAIN_AUDIO_FILE and not IS_SERVER:
+    if ARG_MAIN_AUDIO_FILE:
         AUDIO1_NAME = os.path.basename(ARG_MAIN_AUDIO_FILE)
         load_data.load_audio(str(ARG_MAIN_AUDIO_FILE), 1)
         audio1 = bpy.data.sounds[AUDIO1_NAME]
         
-    if ARG_INTR_AUDIO_FILE and not IS_SERVER:
+    if ARG_INTR_AUDIO_FILE:
         AUDIO2_NAME = os.path.basename(ARG_INTR_AUDIO_FILE)
         load_data.load_audio(str(ARG_INTR_AUDIO_FILE), 2)
         audio2 = bpy.data.sounds[AUDIO2_NAME]
     
 #    bpy.context.scene.sequence_editor.sequences_all['AudioClip1'].volume = 10
-    bpy.context.scene.sequence_editor.sequences_all['AudioClip2'].volume = 0
+    if 'AudioClip2' in bpy.context.scene.sequence_editor.sequences_all:
+        bpy.context.scene.sequence_editor.sequences_all['AudioClip2'].volume = 0
     
     if not os.path.exists(str(output_dir)):
         os.mkdir(str(output_dir))
     
-    framerate = bpy.context.scene.render.fps
-    audio_proc1 = wave.open(os.path.abspath(ARG_MAIN_AUDIO_FILE), 'rb')
-    audio_samples1 = edit_audio.get_volume_strided(audio_proc1, 1 / framerate, -1, -1)
-    audio_samples1 = [abs(x) / 32768 for x in audio_samples1] # normalize scale between 0 and 1
-    audio_samples1 = [x / max(audio_samples1) for x in audio_samples1] # normalize data between 0 and 1
-    audio_samples1 = [0 if x < 0.2 else 1 for x in audio_samples1]
-    audio_samples1 = edit_audio.smooth_kernel(audio_samples1, 10)
-    audio_samples1 = [max(0.0075, x * 0.05) for x in audio_samples1] # scale down and clamp to min
-    
-    audio_proc2 = wave.open(os.path.abspath(ARG_INTR_AUDIO_FILE), 'rb')
-    audio_samples2 = edit_audio.get_volume_strided(audio_proc2, 1 / framerate, -1, -1)
-    audio_samples2 = [abs(x) / 32768 for x in audio_samples2] # normalize scale between 0 and 1
-    audio_samples2 = [x / max(audio_samples2) for x in audio_samples2] # normalize data between 0 and 1
-    audio_samples2 = [0 if x < 0.2 else 1 for x in audio_samples2]
-    audio_samples2 = edit_audio.smooth_kernel(audio_samples2, 10)
-    audio_samples2 = [max(0.0075, x * 0.05) for x in audio_samples2] # scale down and clamp to min
-    
-    if ARG_BUBBLE == True:
-        bubble1 = create_scene.add_speechbubble(0.75)
-        bubble2 = create_scene.add_speechbubble(-0.75)
-        
-        for i in range(ARG_DURATION_IN_FRAMES):
-            start_frame = i * framerate
-            end_frame = (i + 1) * framerate
-            if i < len(audio_samples1):
-                a1s = audio_samples1[i]
-                a2s = audio_samples2[i]
-            else:
-                a1s = audio_samples1[-1]
-                a2s = audio_samples2[-1]
+    # the speech bubbles need both audio tracks, which the server does not pass to Blender
+    if ARG_BUBBLE == True and ARG_MAIN_AUDIO_FILE and ARG_INTR_AUDIO_FILE:
+        framerate = bpy.context.scene.render.fps
+        with timed(timings, 'audio_envelope'):
+            audio_proc1 = wave.open(os.path.abspath(ARG_MAIN_AUDIO_FILE), 'rb')
+            audio_samples1 = edit_audio.get_volume_strided(audio_proc1, 1 / framerate, -1, -1)
+            audio_samples1 = edit_audio.speech_activity(audio_samples1) # normalize, threshold, dilate, scale and clamp
             
-            bubble1.scale = (a1s, a1s, a1s)
-            bubble1.keyframe_insert(data_path='scale', frame=i)
+            audio_proc2 = wave.open(os.path.abspath(ARG_INTR_AUDIO_FILE), 'rb')
+            audio_samples2 = edit_audio.get_volume_strided(audio_proc2, 1 / framerate, -1, -1)
+            audio_samples2 = edit_audio.speech_activity(audio_samples2) # normalize, threshold, dilate, scale and clamp
+        
+        with timed(timings, 'keyframing'):
+            bubble1 = create_scene.add_speechbubble(0.75, ARG_PROFILE)
+            bubble2 = create_scene.add_speechbubble(-0.75, ARG_PROFILE)
             
-            bubble2.scale = (a2s, a2s, a2s)
-            bubble2.keyframe_insert(data_path='scale', frame=i)
+            # key every frame up to the end of the rendered range, which may start past frame 0
+            bubble_frames = ARG_START_FRAME + ARG_DURATION_IN_FRAMES + 1
+            create_scene.animate_speechbubble(bubble1, audio_samples1, bubble_frames)
+            create_scene.animate_speechbubble(bubble2, audio_samples2, bubble_frames)
       
     # 05/04/2023 fix main camera orientation, fix character rotation and personal cameras
     if ARG_MODE == "full_body":     CAM_POS = [3.25, 0, 1.8]
     elif ARG_MODE == "upper_body":  CAM_POS = [0, -2.45, 1.3]
     MAIN_CAM_ROT = [math.radians(80), 0, math.radians(90)]
     
-    create_scene.setup_scene(
-        CAM_POS, 
-        MAIN_CAM_ROT, 
-        bpy.data.objects[OBJ1_friendly_name], 
-        bpy.data.objects[OBJ2_friendly_name], 
-        MAIN_BVH_NAME, 
-        INTR_BVH_NAME)
-        
-    create_scene.add_light(ARG_LIGHTTYPE, ARG_LIGHTRADIUS, ARG_LIGHTPOSITION)
-        
-    setup_camera()
+    if ARG_TEMPLATE:
+        main_cam = bpy.data.objects['Main_cam']
+        main_cam.location = CAM_POS
+        main_cam.rotation_euler = MAIN_CAM_ROT
+    else:
+        with timed(timings, 'scene_setup'):
+            create_scene.setup_scene(
+                CAM_POS, 
+                MAIN_CAM_ROT, 
+                bpy.data.objects[OBJ1_friendly_name], 
+                bpy.data.objects[OBJ2_friendly_name], 
+                None if ARG_BAKE else MAIN_BVH_NAME, 
+                None if ARG_BAKE else INTR_BVH_NAME,
+                profile=ARG_PROFILE)
         
-    total_frames1 = bpy.data.objects[MAIN_BVH_NAME].animation_data.action.frame_range.y
-    total_frames2 = bpy.data.objects[INTR_BVH_NAME].animation_data.action.frame_range.y
+    total_frames1 = bpy.data.objects[MAIN_ACTION_OBJ].animation_data.action.frame_range.y
+    total_frames2 = bpy.data.objects[INTR_ACTION_OBJ].animation_data.action.frame_range.y
     ARG_DURATION_IN_FRAMES = math.floor(min([ARG_DURATION_IN_FRAMES, total_frames1, total_frames2])) 
         
-    main_fp = render_video(
-        str(output_dir), 
-        ARG_IMAGE, 
-        ARG_VIDEO, 
-        output_name, 
-        OBJ1_friendly_name, 
-        OBJ2_friendly_name, 
-        ARG_START_FRAME, 
-        ARG_DURATION_IN_FRAMES, 
-        ARG_RESOLUTION_X, 
-        ARG_RESOLUTION_Y)
+    with timed(timings, 'render'):
+        view_fps = render_video(
+            str(output_dir), 
+            ARG_IMAGE, 
+            ARG_VIDEO, 
+            output_name, 
+            OBJ1_friendly_name, 
+            OBJ2_friendly_name, 
+            ARG_START_FRAME, 
+            ARG_DURATION_IN_FRAMES, 
+            ARG_RESOLUTION_X, 
+            ARG_RESOLUTION_Y,
+            ARG_PREVIEW,
+            ARG_PREVIEW_SCALE,
+            ARG_FRAME_STEP,
+            ARG_VIEWS)
+    # the first view is the job's output, the other views come along as extra files
+    main_fp = view_fps[ARG_VIEWS[0]]
+    for view, view_fp in view_fps.items():
+        emit_event('view_file', view=view, path=view_fp)
     
 #     audio1.use_mono = True
 #     audio2.use_mono = True
@@ -393,8 +527,33 @@ def main():
     
     end = time.time()
     all_time = end - start
-    print("output_file", str(list(output_dir.glob("*"))[0]), flush=True)
+    # the frame range is inclusive
+    rendered_frames = len(range(ARG_START_FRAME, ARG_START_FRAME + ARG_DURATION_IN_FRAMES + 1, ARG_FRAME_STEP if ARG_PREVIEW else 1))
+    emit_event('timings', stages={stage: round(seconds, 3) for stage, seconds in timings.items()}, frames=rendered_frames)
+    emit_event('output_file', path=main_fp)
     print(all_time)
 
+# keeps Blender (and the imported modules) alive between jobs: one JSON job per stdin line
+def serve():
+    emit_event('server_ready')
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job = {}
+        try:
+            job = json.loads(line)
+            main(job['args'])
+        except (Exception, SystemExit):
+            emit_event('job_failed', id=job.get('id'), error=traceback.format_exc())
+        else:
+            emit_event('job_done', id=job.get('id'))
+
 #Code line
-main()
+if '--serve' in get_script_args():
+    serve()
+elif '--build_template' in get_script_args():
+    for profile in create_scene.SCENE_PROFILES:
+        scene_template.ensure_template(script_dir, profile)
+else:
+    main()
@@ -13,3 +13,28 @@ def add_camera(cam_pos, cam_rot, name):
 def get_camera(name):
     cam = bpy.data.objects[name]
     bpy.context.scene.camera = cam
+
+# sets up multiview rendering of [(view, camera name)] in one pass: each view
+# renders from a copy of its camera named 'View_<view>', which Blender finds through the view's
+# camera suffix, and is written to its own file with '_<view>' before the extension
+def setup_multiview(views):
+    scene = bpy.context.scene
+    scene.render.use_multiview = True
+    scene.render.views_format = 'MULTIVIEW'
+    scene.render.image_settings.views_format = 'INDIVIDUAL'
+    for scene_view in scene.render.views:
+        scene_view.use = False
+    view_cams = []
+    for view, camera_name in views:
+        cam = bpy.data.objects[camera_name]
+        view_cam = cam.copy()
+        view_cam.data = cam.data.copy()
+        view_cam.name = 'View_' + view
+        scene.collection.objects.link(view_cam)
+        scene_view = scene.render.views.get(view) or scene.render.views.new(view)
+        scene_view.camera_suffix = '_' + view
+        scene_view.file_suffix = '_' + view
+        scene_view.use = True
+        view_cams.append(view_cam)
+    scene.camera = view_cams[0]
+    return view_cams
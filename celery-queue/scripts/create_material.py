@@ -1,12 +1,23 @@
 import bpy
 import os
 
-def add_materials(work_dir, name):
+# scales an image down to at most max_size pixels on its longest side, 0 keeps it as is;
+# a scaled image is packed, so that a saved scene keeps the smaller version
+def limit_texture_size(image, max_size):
+    width, height = image.size
+    if max_size <= 0 or max(width, height) <= max_size:
+        return
+    factor = max_size / max(width, height)
+    image.scale(max(1, round(width * factor)), max(1, round(height * factor)))
+    image.pack()
+
+def add_materials(work_dir, name, texture_size=0):
     mat = bpy.data.materials.new('gray')
     mat.use_nodes = True
     bsdf = mat.node_tree.nodes["Principled BSDF"]
     texImage = mat.node_tree.nodes.new('ShaderNodeTexImage')
     texImage.image = bpy.data.images.load(os.path.join(work_dir, 'model', "LowP_03_Texture_ColAO_grey5.jpg"))
+    limit_texture_size(texImage.image, texture_size)
     mat.node_tree.links.new(bsdf.inputs['Base Color'], texImage.outputs['Color'])
 
     obj = bpy.data.objects['LowP_01']
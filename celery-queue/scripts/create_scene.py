@@ -1,5 +1,6 @@
 import bpy
 import math
+import numpy as np
 import os
 from pathlib import Path as myPath
 import importlib
@@ -12,7 +13,24 @@ else:
 import create_camera
 importlib.reload(create_camera)
 
-def setup_scene(cam_pos, cam_rot, actor1, actor2, arm1, arm2, plane_size=5, InLocation):
+SKY_COLOR = (0.115, 0.25, 0.3, 1)
+# the world of Blender's default scene, a node tree with a dark grey background
+DEFAULT_WORLD_COLOR = (0.050876, 0.050876, 0.050876)
+
+# level of detail of the scene, from quick previews to the evaluation videos:
+# sky_segments - segments and rings of the sky sphere, 0 for a plain world background colour instead
+# bubble_segments - segments of the speech bubble spheres (half as many rings)
+# texture_size - longest side the character textures are scaled down to, 0 for their full size
+# max_subdivision - subdivision levels rendered at most (Simplify), -1 for no limit
+SCENE_PROFILES = {
+    'draft': {'sky_segments': 0, 'bubble_segments': 12, 'texture_size': 512, 'max_subdivision': 0},
+    'standard': {'sky_segments': 64, 'bubble_segments': 24, 'texture_size': 1024, 'max_subdivision': 1},
+    'final': {'sky_segments': 256, 'bubble_segments': 32, 'texture_size': 0, 'max_subdivision': -1},
+}
+DEFAULT_PROFILE = 'final'
+
+def setup_scene(cam_pos, cam_rot, actor1, actor2, arm1=None, arm2=None, plane_size=5, InLocation=(0, 0, 0), profile=DEFAULT_PROFILE):
+    lod = SCENE_PROFILES[profile]
     
     # Camera Main
     name = 'Main'
@@ -21,12 +39,14 @@ def setup_scene(cam_pos, cam_rot, actor1, actor2, arm1, arm2, plane_size=5, InLo
     # Camera actor 1
     actor1c = actor1.children[0]
     actor1c.name = 'actor1_loc'
-    arm1 = bpy.data.objects[arm1]
+    if arm1 is not None:
+        arm1 = bpy.data.objects[arm1]
     
     # Camera actor 2
     actor2c = actor2.children[0]
     actor2c.name = 'actor2_loc'
-    arm2 = bpy.data.objects[arm2]
+    if arm2 is not None:
+        arm2 = bpy.data.objects[arm2]
     
     cam_pos = [0, 0.75, 1.5]
     cam_rot = [math.radians(80), 0, math.radians(180)]
@@ -42,13 +62,43 @@ def setup_scene(cam_pos, cam_rot, actor1, actor2, arm1, arm2, plane_size=5, InLo
     add_light(light_type, 1, InLocation)
 #    raise KeyboardInterrupt
 
-    # Sky Sphere
-    bpy.ops.mesh.primitive_uv_sphere_add(segments=256, ring_count=256, radius=75)
-    sky_obj = bpy.data.objects['Sphere']
-    sky_obj.name = 'Sky'
-    sky_mat = bpy.data.materials.new(name="SkyColor")
-    sky_mat.diffuse_color = (0.115, 0.25, 0.3, 1)
-    sky_obj.data.materials.append(sky_mat) #add the material to the object
+    # every value a profile controls is set, as a Blender server keeps the scene settings of the previous job
+    bpy.context.scene.render.use_simplify = lod['max_subdivision'] >= 0
+    if lod['max_subdivision'] >= 0:
+        bpy.context.scene.render.simplify_subdivision_render = lod['max_subdivision']
+
+    if lod['sky_segments'] > 0:
+        # Sky Sphere
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=lod['sky_segments'], ring_count=lod['sky_segments'], radius=75)
+        sky_obj = bpy.data.objects['Sphere']
+        sky_obj.name = 'Sky'
+        sky_mat = bpy.data.materials.new(name="SkyColor")
+        sky_mat.diffuse_color = SKY_COLOR
+        sky_obj.data.materials.append(sky_mat) #add the material to the object
+        reset_world_background()
+    else:
+        add_world_background(SKY_COLOR)
+
+# a plain background colour instead of the sky sphere, at no geometry cost
+def add_world_background(color):
+    world = bpy.context.scene.world
+    if world is None:
+        world = bpy.data.worlds.new('World')
+        bpy.context.scene.world = world
+    world.use_nodes = False
+    world.color = color[:3]
+
+# the default world lights the scene in EEVEE, so a scene without one (e.g. an empty factory scene) gets it too
+def reset_world_background():
+    world = bpy.context.scene.world
+    if world is None:
+        world = bpy.data.worlds.new('World')
+        bpy.context.scene.world = world
+    world.use_nodes = True
+    world.color = DEFAULT_WORLD_COLOR
+    background = world.node_tree.nodes.get('Background')
+    if background is not None:
+        background.inputs['Color'].default_value = DEFAULT_WORLD_COLOR + (1,)
 
 def add_plane(prov_size):
     bpy.ops.mesh.primitive_plane_add(size=prov_size)
@@ -60,8 +110,9 @@ def add_plane(prov_size):
     mat.diffuse_color = (0.115, 0.25, 0.3, 1)
     plane_obj.data.materials.append(mat) #add the material to the object
     
-def add_speechbubble(y):
-    bpy.ops.mesh.primitive_uv_sphere_add()
+def add_speechbubble(y, profile=DEFAULT_PROFILE):
+    segments = SCENE_PROFILES[profile]['bubble_segments']
+    bpy.ops.mesh.primitive_uv_sphere_add(segments=segments, ring_count=segments // 2)
     bub_obj = bpy.data.objects['Sphere']
     bub_obj.name = 'SpeechBubble'
     bub_obj.location[0] = 0
@@ -72,8 +123,25 @@ def add_speechbubble(y):
     bub_obj.data.materials.append(mat) #add the material to the object
     return bub_obj
 
+# keys the bubble scale on frames 0..frame_count-1 in one go; frames past the end of scales keep its last value
+def animate_speechbubble(bub_obj, scales, frame_count):
+    scales = np.asarray(scales, dtype=np.float32)[:frame_count]
+    scales = np.pad(scales, (0, frame_count - len(scales)), mode='edge')
+    co = np.empty(2 * frame_count, dtype=np.float32)
+    co[0::2] = np.arange(frame_count)
+    co[1::2] = scales
+    
+    bub_obj.animation_data_create()
+    action = bpy.data.actions.new(bub_obj.name + 'Action')
+    bub_obj.animation_data.action = action
+    for axis in range(3):
+        fcurve = action.fcurves.new('scale', index=axis, action_group='Object Transforms')
+        fcurve.keyframe_points.add(frame_count)
+        fcurve.keyframe_points.foreach_set('co', co)
+        fcurve.update()
+
 def add_light(type, radius, InLocation = (0, 0, 0)):
     bpy.ops.object.light_add(type='SUN', radius=1)
     print('sun added')
     sun_obj = bpy.data.objects['Sun']
-    sun_obj.location(InLocation)
\ No newline at end of file
+    sun_obj.location = InLocation
\ No newline at end of file
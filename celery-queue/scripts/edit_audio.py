@@ -1,4 +1,3 @@
-import bpy
 import math
 import numpy as np
 
@@ -33,27 +32,63 @@ def get_volume(audio, time):
     volume = max(samples)
     return volume
 
+# the first channel of every frame as int16, the same value read_audio_strided reads per sample
+def read_audio(audio):
+    audio.setpos(0)
+    data = np.frombuffer(audio.readframes(audio.getnframes()), dtype=np.uint8)
+    data = data.reshape(-1, audio.getsampwidth() * audio.getnchannels())[:, :2]
+    return np.ascontiguousarray(data).view(np.int16).ravel()
+
+# same times as the original loop: from start, up to and including the first one >= stop
+def get_times_strided(stride, start, stop):
+    if not start < stop:
+        return np.empty(0)
+    times = start + stride * np.arange(math.ceil((stop - start) / stride) + 2)
+    return times[:np.argmax(times >= stop) + 1]
+
+# vectorized get_volume for every time at once, reading the file a single time
 def get_volume_strided(audio, stride, start, stop):
     if start < 0: start = 0
     if stop  < 0: stop = audio.getnframes() / audio.getframerate()
-    times = []
-    v = start
-    i = 0
-    while v < stop:
-        v = start + stride * i
-        times.append(v)
-        i += 1
-    volumes = [get_volume(audio, t) for t in times]
-    return volumes
+    times = get_times_strided(stride, start, stop)
+    samples = read_audio(audio)
+    rate = audio.getframerate()
+    nframes = len(samples)
 
+    # the windows read_audio_strided reads for get_volume(audio, t), in samples
+    time_range = 0.01
+    sample_stride = math.floor(0.001 * rate)
+    window_start = np.maximum(times - time_range, 0)
+    window_stop = times + time_range
+    window_stop = np.where(window_stop < 0, nframes / rate, window_stop)
+    window_start = np.minimum(np.floor(window_start * rate).astype(np.int64), nframes - 1)
+    window_stop = np.minimum(np.floor(window_stop * rate).astype(np.int64), nframes)
+    counts = np.ceil((window_stop - window_start) / sample_stride).astype(np.int64)
+    if len(counts) and counts.min() <= 0:
+        raise ValueError("max() arg is an empty sequence")
+
+    # peak of every window as one gather + reduction; abs wraps -32768 like the int16 scalars do
+    steps = np.arange(counts.max() if len(counts) else 0)
+    positions = window_start[:, None] + steps[None, :] * sample_stride
+    valid = (steps[None, :] < counts[:, None]) & (positions < nframes)
+    peaks = np.abs(samples[np.minimum(positions, nframes - 1)]).astype(np.int32)
+    peaks[~valid] = np.iinfo(np.int32).min
+    return peaks.max(axis=1, initial=np.iinfo(np.int32).min).astype(np.int16)
+
+# 1 wherever a positive value lies within offset frames, the input value elsewhere (along the last axis)
 def smooth_kernel(data, offset=5):
-    out_data = []
-    for i in range(len(data)):
-        start = max(0, i - offset)
-        stop = min(len(data), i + offset + 1)
-        out_data.append(data[i])
-        for j in range(start, stop):
-            if data[j] > 0:
-                out_data[-1] = 1
-                break
-    return out_data
\ No newline at end of file
+    data = np.asarray(data)
+    length = data.shape[-1]
+    active = np.cumsum(data > 0, axis=-1)
+    active = np.concatenate([np.zeros(active.shape[:-1] + (1,), dtype=active.dtype), active], axis=-1)
+    i = np.arange(length)
+    counts = active[..., np.minimum(i + offset + 1, length)] - active[..., np.maximum(i - offset, 0)]
+    return np.where(counts > 0, 1, data)
+
+# speech bubble scale per frame from get_volume_strided output; a 2D array processes one speaker per row
+def speech_activity(volumes, threshold=0.2, offset=10, scale=0.05, min_scale=0.0075):
+    volumes = np.abs(np.asarray(volumes)) / 32768 # normalize scale between 0 and 1
+    volumes = volumes / volumes.max(axis=-1, keepdims=True) # normalize data between 0 and 1
+    active = np.where(volumes < threshold, 0, 1)
+    active = smooth_kernel(active, offset)
+    return np.maximum(min_scale, active * scale) # scale down and clamp to min
\ No newline at end of file
@@ -1,4 +1,5 @@
 import bpy
+import numpy as np
 
 def setup_characters(actor1, actor2):
     arm1 = bpy.context.scene.objects[actor1]
@@ -41,4 +42,182 @@ def constraintBoneTargets(armature = 'Armature', rig = 'None', mode = 'full_body
         bpy.context.object.pose.bones["b_r_leg"].constraints["Copy Rotation"].mute = True
         bpy.context.object.pose.bones["b_l_upleg"].constraints["Copy Rotation"].mute = True
         bpy.context.object.pose.bones["b_l_leg"].constraints["Copy Rotation"].mute = True
-    bpy.ops.object.mode_set(mode='OBJECT')
\ No newline at end of file
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+# bones the upper body mode leaves unconstrained
+LOWER_BODY_BONES = ['b_root', 'b_r_upleg', 'b_r_leg', 'b_l_upleg', 'b_l_leg']
+
+# the values of an fcurve on the given frames, or default for a missing one
+def _fcurve_values(action, data_path, index, frames, default):
+    fcurve = action.fcurves.find(data_path, index=index)
+    if fcurve is None:
+        return np.full(len(frames), default)
+    co = np.empty(2 * len(fcurve.keyframe_points), dtype=np.float32)
+    fcurve.keyframe_points.foreach_get('co', co)
+    if len(co) == 2 * len(frames) and np.array_equal(co[0::2], frames):
+        return co[1::2].astype(np.float64)
+    return np.array([fcurve.evaluate(frame) for frame in frames])
+
+def _axis_rotations(axis, angles):
+    c, s = np.cos(angles), np.sin(angles)
+    mats = np.zeros((len(angles), 3, 3))
+    i, j = [(1, 2), (2, 0), (0, 1)]['XYZ'.index(axis)]
+    mats[:, 'XYZ'.index(axis), 'XYZ'.index(axis)] = 1
+    mats[:, i, i] = c
+    mats[:, i, j] = -s
+    mats[:, j, i] = s
+    mats[:, j, j] = c
+    return mats
+
+# Blender eulers apply their axes in the order of the rotation mode, 'XYZ' is Rz @ Ry @ Rx
+def _euler_matrices(angles, order):
+    mats = np.broadcast_to(np.eye(3), (len(angles), 3, 3))
+    for axis in order:
+        mats = _axis_rotations(axis, angles[:, 'XYZ'.index(axis)]) @ mats
+    return mats
+
+def _quaternion_matrices(q):
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+
+# quaternions (w, x, y, z) of rotation matrices, kept on one hemisphere from frame to frame
+def _matrix_quaternions(mats):
+    m = mats / np.linalg.norm(mats, axis=1, keepdims=True)
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    # the largest of w, x, y, z is computed directly, the others from it
+    candidates = np.stack([trace, m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]], axis=1)
+    largest = np.argmax(candidates, axis=1)
+    q = np.empty((len(m), 4))
+    for k in range(4):
+        rows = largest == k
+        r = m[rows]
+        if k == 0:
+            t = np.sqrt(1 + trace[rows]) * 2
+            q[rows] = np.stack([t / 4, (r[:, 2, 1] - r[:, 1, 2]) / t, (r[:, 0, 2] - r[:, 2, 0]) / t, (r[:, 1, 0] - r[:, 0, 1]) / t], axis=1)
+        else:
+            a, b, c = [(0, 1, 2), (1, 2, 0), (2, 0, 1)][k - 1]
+            t = np.sqrt(1 + r[:, a, a] - r[:, b, b] - r[:, c, c]) * 2
+            q_abc = np.empty((len(r), 4))
+            q_abc[:, 0] = (r[:, c, b] - r[:, b, c]) / t
+            q_abc[:, 1 + a] = t / 4
+            q_abc[:, 1 + b] = (r[:, b, a] + r[:, a, b]) / t
+            q_abc[:, 1 + c] = (r[:, c, a] + r[:, a, c]) / t
+            q[rows] = q_abc
+    flips = np.einsum('ij,ij->i', q[1:], q[:-1]) < 0
+    q[1:] *= np.where(np.cumsum(flips) % 2 == 1, -1, 1)[:, None]
+    return q
+
+def _bones_in_hierarchy_order(armature_data):
+    order = []
+    pending = [bone for bone in armature_data.bones if bone.parent is None]
+    while pending:
+        bone = pending.pop(0)
+        order.append(bone)
+        pending.extend(bone.children)
+    return order
+
+# armature space pose matrices of every bone of an animated armature object, on the given frames
+def _pose_matrices(armobj, frames):
+    action = armobj.animation_data.action
+    pose = {}
+    for bone in _bones_in_hierarchy_order(armobj.data):
+        pose_bone = armobj.pose.bones[bone.name]
+        data_path = 'pose.bones["{}"].'.format(bone.name)
+        basis = np.broadcast_to(np.eye(4), (len(frames), 4, 4)).copy()
+        if pose_bone.rotation_mode == 'QUATERNION':
+            q = np.stack([_fcurve_values(action, data_path + 'rotation_quaternion', i, frames, pose_bone.rotation_quaternion[i]) for i in range(4)], axis=1)
+            basis[:, :3, :3] = _quaternion_matrices(q)
+        elif pose_bone.rotation_mode != 'AXIS_ANGLE':
+            angles = np.stack([_fcurve_values(action, data_path + 'rotation_euler', i, frames, pose_bone.rotation_euler[i]) for i in range(3)], axis=1)
+            basis[:, :3, :3] = _euler_matrices(angles, pose_bone.rotation_mode)
+        scale = np.stack([_fcurve_values(action, data_path + 'scale', i, frames, pose_bone.scale[i]) for i in range(3)], axis=1)
+        basis[:, :3, :3] *= scale[:, None, :]
+        basis[:, :3, 3] = np.stack([_fcurve_values(action, data_path + 'location', i, frames, pose_bone.location[i]) for i in range(3)], axis=1)
+        rest = np.array(bone.matrix_local)
+        if bone.parent is None:
+            pose[bone.name] = rest @ basis
+        else:
+            pose[bone.name] = pose[bone.parent.name] @ (np.linalg.inv(np.array(bone.parent.matrix_local)) @ rest) @ basis
+    return pose
+
+def _add_fcurve(action, data_path, index, group, frames, values):
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    fcurve.keyframe_points.add(len(frames))
+    co = np.empty(2 * len(frames), dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    fcurve.keyframe_points.foreach_set('co', co)
+    fcurve.update()
+
+# what constraintBoneTargets does, computed once with numpy and written as an action on the armature:
+# every bone the rig has gets the world rotation of the rig's bone (and body_world its world location
+# in full body mode), so the rig can be deleted before rendering
+def bakeBoneTargets(armature = 'Armature', rig = 'None', mode = 'full_body'):
+    armobj = bpy.data.objects[armature]
+    rigobj = bpy.data.objects[rig]
+    bpy.context.view_layer.update()
+    for pose_bone in armobj.pose.bones:
+        for c in pose_bone.constraints:
+            pose_bone.constraints.remove(c)
+
+    rig_action = rigobj.animation_data.action
+    # the BVH importer keys every channel on every frame
+    keys = rig_action.fcurves[0].keyframe_points
+    co = np.empty(2 * len(keys), dtype=np.float32)
+    keys.foreach_get('co', co)
+    frames = co[0::2]
+    rig_world = np.array(rigobj.matrix_world)
+    targets = {name: rig_world @ matrix for name, matrix in _pose_matrices(rigobj, frames).items()}
+
+    arm_world = np.array(armobj.matrix_world)
+    arm_world_inv = np.linalg.inv(arm_world)
+    action = bpy.data.actions.new(armature + 'Baked')
+    armobj.animation_data_create()
+    armobj.animation_data.action = action
+    pose = {}
+    for bone in _bones_in_hierarchy_order(armobj.data):
+        pose_bone = armobj.pose.bones[bone.name]
+        rest = np.array(bone.matrix_local)
+        if bone.parent is None:
+            base = np.broadcast_to(rest, (len(frames), 4, 4))
+        else:
+            base = pose[bone.parent.name] @ (np.linalg.inv(np.array(bone.parent.matrix_local)) @ rest)
+        basis = np.array(pose_bone.matrix_basis)
+        pose[bone.name] = base @ basis
+        target = targets.get(bone.name)
+        if target is None or (mode == 'upper_body' and bone.name in LOWER_BODY_BONES):
+            continue
+
+        # the constraints work in world space: the rotation is replaced, the scale kept
+        world = arm_world @ pose[bone.name]
+        target_rotation = target[:, :3, :3] / np.linalg.norm(target[:, :3, :3], axis=1, keepdims=True)
+        world[:, :3, :3] = target_rotation * np.linalg.norm(world[:, :3, :3], axis=1, keepdims=True)
+        copy_location = bone.name == 'body_world' and mode == 'full_body'
+        if copy_location:
+            world[:, :3, 3] = target[:, :3, 3]
+        pose[bone.name] = arm_world_inv @ world
+        basis = np.linalg.inv(base) @ pose[bone.name]
+
+        data_path = 'pose.bones["{}"].'.format(bone.name)
+        pose_bone.rotation_mode = 'QUATERNION'
+        q = _matrix_quaternions(basis[:, :3, :3])
+        for i in range(4):
+            _add_fcurve(action, data_path + 'rotation_quaternion', i, bone.name, frames, q[:, i])
+        if copy_location:
+            for i in range(3):
+                _add_fcurve(action, data_path + 'location', i, bone.name, frames, basis[:, i, 3])
+
+# deletes a BVH rig, with its armature and action, once nothing is constrained to it
+def remove_rig(rig):
+    rigobj = bpy.data.objects[rig]
+    armature = rigobj.data
+    action = rigobj.animation_data.action if rigobj.animation_data else None
+    bpy.data.objects.remove(rigobj, do_unlink=True)
+    bpy.data.armatures.remove(armature)
+    if action is not None:
+        bpy.data.actions.remove(action)
@@ -32,6 +32,28 @@ def load_fbx(filepath, name):
         'b_r_foot_End'
     )
     bpy.data.objects['Armature'].name = name
+
+# a second character from an imported one: a new armature object, posed on its own,
+# with linked duplicates of its children that share their mesh, materials and textures
+def duplicate_fbx(source, name):
+    armature = bpy.data.objects[source]
+    copy = armature.copy()
+    copy.name = name
+    for collection in armature.users_collection:
+        collection.objects.link(copy)
+    duplicate_children(armature, copy)
+    return copy
+
+def duplicate_children(parent, parent_copy):
+    for child in parent.children:
+        child_copy = child.copy()
+        for collection in child.users_collection:
+            collection.objects.link(child_copy)
+        child_copy.parent = parent_copy
+        for modifier in child_copy.modifiers:
+            if modifier.type == 'ARMATURE' and modifier.object == parent:
+                modifier.object = parent_copy
+        duplicate_children(child, child_copy)
         
 def load_bvh(filepath):
     bpy.ops.import_anim.bvh(
@@ -40,4 +62,5 @@ def load_bvh(filepath):
         update_scene_fps=False, 
         update_scene_duration=True, 
         global_scale=0.01
-    )
\ No newline at end of file
+    )
+    return bpy.context.object
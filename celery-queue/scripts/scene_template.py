@@ -0,0 +1,68 @@
+import bpy
+import hashlib
+import os
+from pathlib import Path as myPath
+import importlib
+
+import load_data
+importlib.reload(load_data)
+import create_material
+importlib.reload(create_material)
+import create_scene
+importlib.reload(create_scene)
+
+# bump to force a rebuild when the template content changes for reasons not covered below
+TEMPLATE_VERSION = 2
+# everything that ends up in the template, relative to the render script directory
+TEMPLATE_SOURCES = [
+    'model/GenevaModel_v2_Tpose_Final.fbx',
+    'model/LowP_03_Texture_ColAO_grey5.jpg',
+    'scripts/scene_template.py',
+    'scripts/load_data.py',
+    'scripts/create_material.py',
+    'scripts/create_scene.py',
+    'scripts/create_camera.py',
+    'scripts/edit_character.py',
+]
+
+def template_hash(work_dir, profile=create_scene.DEFAULT_PROFILE):
+    sha = hashlib.sha256()
+    sha.update('{} {} {}'.format(TEMPLATE_VERSION, bpy.app.version_string, profile).encode('utf-8'))
+    for source in TEMPLATE_SOURCES:
+        sha.update(source.encode('utf-8'))
+        sha.update(myPath(work_dir, source).read_bytes())
+    return sha.hexdigest()[:16]
+
+def template_path(work_dir, digest, profile=create_scene.DEFAULT_PROFILE):
+    template_dir = myPath(os.environ.get('GENEA_TEMPLATE_DIR', os.path.join(work_dir, 'cache')))
+    return template_dir / 'scene_template_{}_{}.blend'.format(profile, digest)
+
+# the static part of the scene: both characters with materials, cameras, floor, light and sky
+def build_template(work_dir, filepath, profile=create_scene.DEFAULT_PROFILE):
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    fbx_model = os.path.join(work_dir, 'model', "GenevaModel_v2_Tpose_Final.fbx")
+    texture_size = create_scene.SCENE_PROFILES[profile]['texture_size']
+    load_data.load_fbx(fbx_model, 'OBJ1')
+    create_material.add_materials(work_dir, 'OBJ1', texture_size)
+    load_data.duplicate_fbx('OBJ1', 'OBJ2')
+    # the main camera is placed per job, as its position depends on the visualization mode
+    create_scene.setup_scene([0, 0, 0], [0, 0, 0], bpy.data.objects['OBJ1'], bpy.data.objects['OBJ2'], profile=profile)
+
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_filepath = filepath.with_name('{}.{}.tmp.blend'.format(filepath.stem, os.getpid()))
+    bpy.ops.wm.save_as_mainfile(filepath=str(tmp_filepath), copy=True, relative_remap=False)
+    os.replace(str(tmp_filepath), str(filepath))
+
+# builds the template of a scene profile if its sources changed, returns its path and hash
+def ensure_template(work_dir, profile=create_scene.DEFAULT_PROFILE):
+    digest = template_hash(work_dir, profile)
+    filepath = template_path(work_dir, digest, profile)
+    if not filepath.exists():
+        print('[INFO] Building scene template {}'.format(filepath))
+        build_template(work_dir, filepath, profile)
+    return filepath, digest
+
+def open_template(work_dir, profile=create_scene.DEFAULT_PROFILE):
+    filepath, digest = ensure_template(work_dir, profile)
+    bpy.ops.wm.open_mainfile(filepath=str(filepath), load_ui=False)
+    return digest
@@ -6,16 +6,27 @@
 
 
 import os
-from celery import Celery
+import json
+import math
+import socket
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from celery import Celery, chord, states
+from celery.signals import task_postrun, worker_ready
 import subprocess
 from celery.utils.log import get_task_logger
-import requests
-import tempfile
 from pyvirtualdisplay import Display
-from bvh import Bvh
 import time
 import ffmpeg
-from pathlib import Path
+from artifact_store import get_artifact_store, link_or_copy
+import render_queue
+import job_events
+import bvh_validation
+import metrics
 
 Display().start()
 
@@ -24,6 +35,31 @@ logger = get_task_logger(__name__)
 
 
 WORKER_TIMEOUT = int(os.environ["WORKER_TIMEOUT"])
+BLENDER_EXECUTABLE = "/blender/blender-2.83.0-linux64/blender"
+BLENDER_SCRIPT = "blender_render_2024.py"
+# number of jobs a Blender server renders before it is recycled (1 = fresh Blender per job)
+BLENDER_MAX_JOBS = int(os.environ.get("BLENDER_MAX_JOBS", 50))
+# renders longer than this many frames are split into segments rendered in parallel (0 = never)
+RENDER_SHARD_FRAMES = int(os.environ.get("RENDER_SHARD_FRAMES", 0))
+# bake the BVH motion into the characters' actions instead of evaluating bone constraints per frame
+BAKE_RETARGETING = os.environ.get("BAKE_RETARGETING", "0") == "1"
+# the gopsize set by the render script; segments start on a multiple of it
+GOP_SIZE = 30
+# progress is reported at most once per interval, and only once it moved by the step
+PROGRESS_MIN_INTERVAL = 1.0
+PROGRESS_MIN_STEP = 0.01
+# port of the worker's Prometheus exporter (0 = none); the API exports the queue and cache metrics
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", 9540))
+# every worker labels the metrics it records with its host name, and only exports its own
+WORKER_NAME = socket.gethostname()
+WORKER_METRICS = {
+	"genea_job_queue_wait_seconds": "Time the jobs waited in the queue before a worker started them.",
+	"genea_job_run_seconds": "Time from the start of the successful jobs to their result.",
+	"genea_stage_seconds": "Time the jobs spent in each stage, from download to upload.",
+	"genea_frames_rendered_total": "Frames rendered by the successful jobs.",
+	"genea_worker_transferred_bytes_total": "Bytes of inputs downloaded and of videos uploaded by the worker.",
+	"genea_job_failures_total": "Failed jobs, by reason.",
+}
 celery = Celery(
 	"tasks",
 	broker=os.environ["CELERY_BROKER_URL"],
@@ -31,143 +67,504 @@ celery = Celery(
 )
 
 class TaskFailure(Exception):
-	pass
+	"""A job failure, with a short reason for the failure metrics besides the message."""
+
+	def __init__(self, message, reason="error"):
+		super().__init__(message)
+		self.reason = reason
+
+
+class BlenderServer:
+	"""A long-lived Blender process running the render script in --serve mode.
+
+	Jobs are written to its stdin as JSON lines. Its stdout carries Blender's usual
+	output, interleaved with the script's JSON events, up to a "job_done" or
+	"job_failed" event with the job's id once the job is over.
+	"""
+
+	def __init__(self, max_jobs):
+		self.max_jobs = max_jobs
+		self.process = None
+		self.jobs = 0
+
+	def start(self):
+		self.process = subprocess.Popen(
+			[BLENDER_EXECUTABLE, "-b", "--python", BLENDER_SCRIPT, "--", "--serve"],
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT,
+		)
+		self.jobs = 0
+		# wait until the script reads jobs, so that the startup can be timed apart from the job
+		last_lines = deque(maxlen=50)
+		for line in iter(self.process.stdout.readline, b""):
+			line = line.decode("utf-8", errors="replace").strip()
+			last_lines.append(line)
+			event = parse_event(line)
+			if event is not None and event["event"] == "server_ready":
+				return
+		self.stop()
+		raise TaskFailure("\n".join(last_lines), "blender_startup")
+
+	def stop(self):
+		if self.process is not None and self.process.poll() is None:
+			self.process.stdin.close()
+			try:
+				self.process.wait(timeout=10)
+			except subprocess.TimeoutExpired:
+				self.process.kill()
+		self.process = None
+
+	def ensure_running(self):
+		"""(Re)starts the server if it is not running or due to be recycled; True if it did."""
+		if self.process is None or self.process.poll() is not None or self.jobs >= self.max_jobs:
+			self.stop()
+			self.start()
+			return True
+		return False
+
+	def submit(self, script_args):
+		"""Sends a job, returns its id and the stdout to read its events from."""
+		self.ensure_running()
+		self.jobs += 1
+		job_id = uuid.uuid4().hex
+		job = json.dumps({"id": job_id, "args": [str(arg) for arg in script_args]})
+		self.process.stdin.write(job.encode("utf-8") + b"\n")
+		self.process.stdin.flush()
+		return job_id, self.process.stdout
+
+
+class ProgressReporter:
+	"""Coalesces per-frame progress into one report per PROGRESS_MIN_INTERVAL and PROGRESS_MIN_STEP."""
+
+	def __init__(self, report):
+		self.report = report
+		self.pending = None
+		self.reported = None
+		self.reported_at = None
+
+	def update(self, current, total):
+		self.pending = (current, total)
+		now = time.monotonic()
+		if self.reported is not None:
+			if now - self.reported_at < PROGRESS_MIN_INTERVAL:
+				return
+			if current - self.reported[0] < PROGRESS_MIN_STEP * total:
+				return
+		self._report(now)
+
+	def flush(self):
+		if self.pending is not None and self.pending != self.reported:
+			self._report(time.monotonic())
+
+	def _report(self, now):
+		self.report(*self.pending)
+		self.reported = self.pending
+		self.reported_at = now
+
+
+def parse_event(line):
+	"""The render script's JSON event on a stdout line, or None for Blender's own output."""
+	if not line.startswith("{"):
+		return None
+	try:
+		event = json.loads(line)
+	except ValueError:
+		return None
+	return event if isinstance(event, dict) and "event" in event else None
+
+
+@contextmanager
+def timed(timings, stage):
+	"""Adds the wall-clock time of the block to timings[stage]."""
+	stage_start = time.perf_counter()
+	try:
+		yield
+	finally:
+		timings[stage] = timings.get(stage, 0) + time.perf_counter() - stage_start
+
+
+def add_timings(timings, more_timings):
+	for stage, seconds in more_timings.items():
+		timings[stage] = timings.get(stage, 0) + seconds
+
+
+def job_timings(timings, frames):
+	"""The job's {stage: seconds} for the result metadata, with the render time per frame."""
+	timings = dict(timings)
+	if frames and "render" in timings:
+		timings["render_per_frame"] = timings["render"] / frames
+	return {stage: round(seconds, 3) for stage, seconds in timings.items()}
+
+
+def record_job_metrics(redis, job_id, metadata):
+	timings = metadata["timings"]
+	logger.info("job %s stage timings: %s", job_id, ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items()))
+	metrics.observe_timings(redis, timings, worker=WORKER_NAME)
+	metrics.incr(redis, "genea_frames_rendered_total", metadata.get("frames", 0), worker=WORKER_NAME)
+
+
+blender_server = BlenderServer(BLENDER_MAX_JOBS)
+artifact_store = get_artifact_store()
 
 
 def validate_bvh_file(bvh_file):
+	# the API validates uploads too; this covers files that reach the queue by other means
 	MAX_NUMBER_FRAMES = int(os.environ["MAX_NUMBER_FRAMES"])
 	FRAME_TIME = 1.0 / float(os.environ["RENDER_FPS"])
-	FRAME_EPSILON = 0.00001
-
-	file_content = bvh_file.decode("utf-8")
-	mocap = Bvh(file_content)
-	counter = None
-	for line in file_content.split("\n"):
-		if counter is not None and line.strip():
-			counter += 1
-		if line.strip() == "MOTION":
-			counter = -2
-
-	if mocap.nframes != counter:
-		raise TaskFailure(
-			f"The number of rows with motion data ({counter}) does not match the Frames field ({mocap.nframes})"
-		)
+	try:
+		return bvh_validation.validate_bvh_file(bvh_file, MAX_NUMBER_FRAMES, FRAME_TIME)
+	except bvh_validation.BvhValidationError as e:
+		raise TaskFailure(str(e), "invalid_bvh")
 
-	if MAX_NUMBER_FRAMES != -1 and mocap.nframes > MAX_NUMBER_FRAMES:
-		raise TaskFailure(
-			f"The supplied number of frames ({mocap.nframes}) is bigger than {MAX_NUMBER_FRAMES}"
-		)
+def update_job_state(task, state, meta=None, task_id=None):
+	"""update_state that also publishes the change on the job's event channel."""
+	task.update_state(task_id=task_id, state=state, meta=meta)
+	job_events.publish(task.backend.client, task_id or task.request.id, state, meta)
 
-	if mocap.frame_time < FRAME_TIME - FRAME_EPSILON or mocap.frame_time > FRAME_TIME + FRAME_EPSILON:
-		raise TaskFailure(
-			f"The supplied frame time ({mocap.frame_time}) differs from the required {FRAME_TIME} (+/- {FRAME_EPSILON})"
-		)
 
-@celery.task(name="tasks.render", bind=True, hard_time_limit=WORKER_TIMEOUT)
-def render(self, bvh_file_uri: str, audio_file_uri: str, rotate_flag: str, visualization_mode: str) -> str:
-	HEADERS = {"Authorization": f"Bearer " + os.environ["SYSTEM_TOKEN"]}
-	API_SERVER = os.environ["API_SERVER"]
+def fetch_file(file_uri, destination):
+	file = artifact_store.fetch(file_uri, destination)
+	metrics.incr(celery.backend.client, "genea_worker_transferred_bytes_total", file.stat().st_size, direction="download", worker=WORKER_NAME)
+	return file
 
-	logger.info("rendering..")
-	self.update_state(state="PROCESSING")
 
-	audio_file = requests.get(API_SERVER + audio_file_uri, headers=HEADERS).content if audio_file_uri is not None else None
-	bvh_file = requests.get(API_SERVER + bvh_file_uri, headers=HEADERS).content
-	validate_bvh_file(bvh_file)
-	
-	def call_blender_process(script_args):
-		process = subprocess.Popen(
-			[
-				"/blender/blender-2.83.0-linux64/blender",
-				"-b",
-				"--python",
-				"blender_render.py",
-				"--",
-			] + script_args,
-			stdout=subprocess.PIPE,
-			stderr=subprocess.PIPE,
-		)
-		
-		total = None
-		current_frame = None
-		for line in process.stdout:
-			#print(line) # debug process prints
-			line = line.decode("utf-8").strip()
-			if line.startswith("total_frames "):
-				_, total = line.split(" ")
-				total = int(float(total))
-			elif line.startswith("Append frame "):
-				*_, current_frame = line.split(" ")
-				current_frame = int(current_frame)
-			elif line.startswith("output_file"):
-				_, file_name = line.split(" ")
-				return file_name
-			if total and current_frame:
-				self.update_state(
-					state="RENDERING", meta={"current": current_frame, "total": total}
-				)
-		if process.returncode != 0:
-			raise TaskFailure(process.stderr.read().decode("utf-8"))
-	
-	def call_ffmpeg_process(video_file, audio_file, output_file):
-		if ".mp4" not in video_file:
-			raise TaskFailure("Only MP4 video stream is currently supported!")
-		if ".wav" not in audio_file:
-			raise TaskFailure("Only WAV audio stream is currently supported!")
-		
-		self.update_state(
-			state="COMBINING A/V"
-		)
+def publish_file(file_name):
+	size = os.path.getsize(file_name)
+	file_uri = artifact_store.publish(file_name)
+	metrics.incr(celery.backend.client, "genea_worker_transferred_bytes_total", size, direction="upload", worker=WORKER_NAME)
+	return file_uri
+
+
+def release_files(*file_uris):
+	for file_uri in file_uris:
+		if file_uri is not None:
+			artifact_store.release(file_uri)
 
-		# FFMPEG CMD ARGS --> ["ffmpeg", "-i", video_file, "-i", audio_file, "-c:v", "copy", "-c:a", "aac", "-map", "0:v:0", "-map", "1:a:0", "-shortest", output_file]
-		
-		v_stream = ffmpeg.input(video_file)['v']
-		a_stream = ffmpeg.input(audio_file)['a']
-		output_ffmpeg = ffmpeg.output(v_stream, a_stream, output_file, vcodec='copy', acodec='aac', **{'shortest': None, 'y': None})
-		ffmpeg_result = ffmpeg.run(output_ffmpeg, capture_stdout=True, capture_stderr=True)
-		if ffmpeg_result[0] != b'':
-			print("FFMPEG ERROR")
-			raise TaskFailure(ffmpeg_result[0].decode("utf-8"))
-		return output_file
-		
+
+def blender_script_args(bvh_file_name, output_dir, rotate_flag, visualization_mode, start=None, duration=None, audio_file_name=None, profile=None, preview=False, views=None):
+	script_args = []
+	script_args.append('--input_main_bvh')
+	script_args.append(bvh_file_name)
+	script_args.append('--input_intr_bvh')
+	script_args.append(bvh_file_name)
+	if audio_file_name is not None:
+		# Blender muxes the audio in while it encodes the video
+		script_args.append('--input_main_wav')
+		script_args.append(audio_file_name)
+	script_args.append('--output_name')
+	script_args.append('video')
+	if start is not None:
+		script_args.append('--start')
+		script_args.append(start)
+	script_args.append('--duration')
+	script_args.append(duration if duration is not None else os.environ["RENDER_DURATION_FRAMES"])
+	script_args.append('--video')
+	script_args.append('--png')
+	script_args.append('--res_x')
+	script_args.append(os.environ["RENDER_RESOLUTION_X"])
+	script_args.append('--res_y')
+	script_args.append(os.environ["RENDER_RESOLUTION_Y"])
+	script_args.append('-o')
+	script_args.append(output_dir)
+	script_args.append('--visualization_mode')
+	script_args.append(visualization_mode)
+	script_args.append('--template')
+	if BAKE_RETARGETING:
+		script_args.append('--bake')
+	if profile is not None:
+		script_args.append('--profile')
+		script_args.append(profile)
+	if preview:
+		script_args.append('--preview')
+	if views:
+		script_args.append('--views')
+		script_args.extend(views)
+	if rotate_flag is not None:
+		script_args.append('--rotate')
+		script_args.append(rotate_flag)
+	return script_args
+
+
+def call_blender_process(script_args, on_progress, timings):
+	"""Renders a job on the Blender server; the script's stage timings are added to timings."""
+	startup_start = time.perf_counter()
+	if blender_server.ensure_running():
+		timings["blender_startup"] = time.perf_counter() - startup_start
+	job_id, stdout = blender_server.submit(script_args)
 	
-	output_file = None
-	output_dir = Path(tempfile.mkdtemp()) / "video"
-	with tempfile.NamedTemporaryFile(suffix=".bvh") as tmp_bvh:
-		tmp_bvh.write(bvh_file)
-		tmp_bvh.seek(0)
-		script_args = []
-		script_args.append('--input1')
-		script_args.append(tmp_bvh.name)
-		script_args.append('--input2')
-		script_args.append(tmp_bvh.name)
-		script_args.append('--duration')
-		script_args.append(os.environ["RENDER_DURATION_FRAMES"])
-		script_args.append('--video')
-		script_args.append('--png')
-		script_args.append('--res_x')
-		script_args.append(os.environ["RENDER_RESOLUTION_X"])
-		script_args.append('--res_y')
-		script_args.append(os.environ["RENDER_RESOLUTION_Y"])
-		script_args.append('-o')
-		script_args.append(output_dir)
-		script_args.append('--visualization_mode')
-		script_args.append(visualization_mode)
-		if rotate_flag is not None:
-			script_args.append('--rotate')
-			script_args.append(rotate_flag)
-		
-		output_file = call_blender_process(script_args)
-		if audio_file:
-			with tempfile.NamedTemporaryFile(suffix=".wav") as tmp_wav:
-				tmp_wav.write(audio_file)
-				tmp_wav.seek(0)
-				output_file = call_ffmpeg_process(output_file, tmp_wav.name, os.path.join(os.path.dirname(output_file),"combined_av.mp4"))
-
-	if output_file is None:
-		raise TaskFailure("Something went wrong... Not sure why.")
-		
-	files = {"file": (os.path.basename(output_file), open(output_file, "rb"))}
-	return requests.post(
-		API_SERVER + "/upload_video", files=files, headers=HEADERS
-	).text
\ No newline at end of file
+	progress = ProgressReporter(on_progress)
+	total = None
+	file_name = None
+	view_files = {}
+	stages = {}
+	metadata = {}
+	last_lines = deque(maxlen=50)
+	try:
+		for line in iter(stdout.readline, b""):
+			line = line.decode("utf-8", errors="replace").strip()
+			last_lines.append(line)
+			event = parse_event(line)
+			if event is None:
+				continue
+			if event["event"] in ("job_done", "job_failed") and event.get("id") != job_id:
+				# the end of an earlier job that was left running; everything read so far was its output
+				total = None
+				file_name = None
+				view_files = {}
+				stages = {}
+				metadata = {}
+				continue
+			if event["event"] == "total_frames":
+				total = int(event["total"])
+			elif event["event"] == "frame":
+				if total:
+					progress.update(event["frame"], total)
+			elif event["event"] == "output_file":
+				file_name = event["path"]
+			elif event["event"] == "view_file":
+				view_files[event["view"]] = event["path"]
+			elif event["event"] == "template_hash":
+				metadata["template_hash"] = event["hash"]
+			elif event["event"] == "timings":
+				stages = event["stages"]
+				metadata["frames"] = event["frames"]
+			elif event["event"] == "job_done":
+				progress.flush()
+				add_timings(timings, stages)
+				if len(view_files) > 1:
+					metadata["view_files"] = view_files
+				return file_name, metadata
+			elif event["event"] == "job_failed":
+				# the scene may be left in any state, so the next job gets a fresh Blender
+				blender_server.stop()
+				raise TaskFailure(event["error"], "blender")
+	except TaskFailure:
+		raise
+	except BaseException:
+		# e.g. a failed progress report or a time limit: the server is still busy with this job
+		blender_server.stop()
+		raise
+	blender_server.stop()
+	raise TaskFailure("\n".join(last_lines), "blender_crashed")
+
+
+def concat_segments(segment_files, output_file, audio_file=None, duration=None):
+	"""Joins the segments, muxing in the audio on the way, in a single ffmpeg pass.
+
+	Like Blender does for an unsharded render, the audio is cut at the end of the video
+	(duration seconds) and the video is kept whole when the audio is shorter.
+	"""
+	# FFMPEG CMD ARGS --> ["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file, "-t", duration, "-i", audio_file, "-c:v", "copy", "-c:a", "aac", "-map", "0:v:0", "-map", "1:a:0", output_file]
+	list_file = os.path.join(os.path.dirname(output_file), "segments.txt")
+	with open(list_file, "w") as f:
+		for segment_file in segment_files:
+			f.write(f"file '{segment_file}'\n")
+	streams = [ffmpeg.input(list_file, format='concat', safe=0)['v']]
+	options = {'vcodec': 'copy', 'y': None}
+	if audio_file is not None:
+		audio_options = {'t': duration} if duration is not None else {}
+		streams.append(ffmpeg.input(audio_file, **audio_options)['a'])
+		options.update(acodec='aac')
+	output_ffmpeg = ffmpeg.output(*streams, output_file, **options)
+	try:
+		ffmpeg.run(output_ffmpeg, capture_stdout=True, capture_stderr=True)
+	except ffmpeg.Error as e:
+		raise TaskFailure(e.stderr.decode("utf-8"), "ffmpeg")
+	return output_file
+
+
+def plan_segments(total_frames):
+	"""Splits frames [0, total_frames) into GOP-aligned [start, end) ranges of about RENDER_SHARD_FRAMES."""
+	shard_frames = math.ceil(RENDER_SHARD_FRAMES / GOP_SIZE) * GOP_SIZE
+	segments = [[start, min(start + shard_frames, total_frames)] for start in range(0, total_frames, shard_frames)]
+	# fold a short tail into the previous segment rather than render a tiny one
+	if len(segments) > 1 and segments[-1][1] - segments[-1][0] < GOP_SIZE:
+		segments[-2][1] = segments.pop()[1]
+	return segments
+
+
+@celery.task(name="tasks.render", bind=True, hard_time_limit=WORKER_TIMEOUT)
+def render(self, bvh_file_uri: str, audio_file_uri: str, rotate_flag: str, visualization_mode: str, cache_key: str = None, profile: str = None, preview: bool = False, views: list = None) -> dict:
+	logger.info("rendering..")
+	queue_wait = render_queue.start(self.backend.client, self.request.id)
+	if queue_wait is not None:
+		metrics.observe(self.backend.client, "genea_job_queue_wait_seconds", queue_wait, worker=WORKER_NAME)
+	update_job_state(self, "PROCESSING")
+
+	def on_progress(current_frame, total):
+		update_job_state(self, "RENDERING", {"current": current_frame, "total": total})
+
+	timings = {}
+	# the inputs are only released once the task is over, so a redelivered task still finds them
+	with artifact_store.workdir() as work_dir:
+		try:
+			with timed(timings, "download"):
+				audio_file = fetch_file(audio_file_uri, work_dir / "audio.wav") if audio_file_uri is not None else None
+				bvh_file = fetch_file(bvh_file_uri, work_dir / "input.bvh")
+			with timed(timings, "validation"):
+				nframes = validate_bvh_file(bvh_file)
+
+			duration = min(nframes, int(os.environ["RENDER_DURATION_FRAMES"]))
+			# previews render every few frames only, so they are never worth sharding; segments render the main agent's view only
+			if RENDER_SHARD_FRAMES > 0 and duration > RENDER_SHARD_FRAMES and not preview and not views:
+				raise self.replace(render_sharded(self.request.id, work_dir, bvh_file, audio_file, rotate_flag, visualization_mode, duration, cache_key, timings, profile))
+
+			script_args = blender_script_args(bvh_file, work_dir / "video", rotate_flag, visualization_mode, audio_file_name=audio_file, profile=profile, preview=preview, views=views)
+			output_file, metadata = call_blender_process(script_args, on_progress, timings)
+		finally:
+			release_files(bvh_file_uri, audio_file_uri)
+
+		if output_file is None:
+			raise TaskFailure("Something went wrong... Not sure why.", "no_output")
+
+		with timed(timings, "upload"):
+			file_uri = publish_file(output_file)
+			# the job's video is one of the views, the others are published next to it
+			view_files = metadata.pop("view_files", {})
+			if view_files:
+				metadata["views"] = {view: file_uri if path == output_file else publish_file(path) for view, path in view_files.items()}
+		metadata["timings"] = job_timings(timings, metadata.get("frames"))
+		record_job_metrics(self.backend.client, self.request.id, metadata)
+		if cache_key is not None:
+			metadata["cache_key"] = cache_key
+		return {"file": file_uri, "metadata": metadata}
+
+
+def render_sharded(job_id, work_dir, bvh_file, audio_file, rotate_flag, visualization_mode, duration, cache_key=None, timings=None, profile=None):
+	"""A chord rendering the segments in parallel and joining them, to replace a render task with.
+
+	The render script renders frames start..start+duration inclusive, so the
+	unsharded render covers duration + 1 frames. timings, the stages so far, are
+	passed on to the combine task, which adds up the stages of the whole job.
+	"""
+	total_frames = duration + 1
+	segments = plan_segments(total_frames)
+	# every task fetches and releases its own copy of the inputs
+	header = []
+	for index, (start, end) in enumerate(segments):
+		bvh_copy = work_dir / f"segment_{index:04d}.bvh"
+		link_or_copy(bvh_file, bvh_copy)
+		header.append(render_segment.s(job_id, index, start, end, total_frames, publish_file(bvh_copy), rotate_flag, visualization_mode, profile))
+	audio_file_uri = None
+	if audio_file is not None:
+		audio_copy = work_dir / "segments_audio.wav"
+		link_or_copy(audio_file, audio_copy)
+		audio_file_uri = publish_file(audio_copy)
+	return chord(header, combine_segments.s(audio_file_uri, cache_key, timings))
+
+
+@celery.task(name="tasks.render_segment", bind=True, hard_time_limit=WORKER_TIMEOUT)
+def render_segment(self, job_id: str, index: int, start: int, end: int, total_frames: int, bvh_file_uri: str, rotate_flag: str, visualization_mode: str, profile: str = None) -> dict:
+	# progress is reported on the job the chord replaced, whose id the callback inherits
+	progress_key = f"genea:segment_progress:{job_id}"
+	redis = self.backend.client
+
+	def on_progress(current_frame, total):
+		redis.hset(progress_key, index, min(current_frame - start + 1, end - start))
+		redis.expire(progress_key, WORKER_TIMEOUT * 2)
+		current = sum(int(frames) for frames in redis.hvals(progress_key))
+		update_job_state(self, "RENDERING", {"current": current, "total": total_frames}, task_id=job_id)
+
+	timings = {}
+	with artifact_store.workdir() as work_dir:
+		try:
+			with timed(timings, "download"):
+				bvh_file = fetch_file(bvh_file_uri, work_dir / "input.bvh")
+			# the render script's frame range is inclusive
+			script_args = blender_script_args(bvh_file, work_dir / "video", rotate_flag, visualization_mode, start, end - start - 1, profile=profile)
+			output_file, metadata = call_blender_process(script_args, on_progress, timings)
+		finally:
+			release_files(bvh_file_uri)
+
+		if output_file is None:
+			raise TaskFailure("Something went wrong... Not sure why.", "no_output")
+
+		with timed(timings, "upload"):
+			file_uri = publish_file(output_file)
+		# unrounded, as the combine task adds them up
+		metadata["timings"] = timings
+		return {"file": file_uri, "metadata": metadata}
+
+
+@celery.task(name="tasks.combine_segments", bind=True, hard_time_limit=WORKER_TIMEOUT)
+def combine_segments(self, segments: list, audio_file_uri: str, cache_key: str = None, timings: dict = None) -> dict:
+	self.backend.client.delete(f"genea:segment_progress:{self.request.id}")
+
+	# the stages of the segments are summed, so they add up to the worker time of the job rather than its wall-clock time
+	timings = dict(timings or {})
+	for segment in segments:
+		add_timings(timings, segment["metadata"].get("timings", {}))
+	with artifact_store.workdir() as work_dir:
+		segment_files = []
+		try:
+			with timed(timings, "download"):
+				for index, segment in enumerate(segments):
+					segment_file = fetch_file(segment["file"], work_dir / f"segment_{index:04d}.mp4")
+					segment_files.append(str(segment_file))
+				audio_file = fetch_file(audio_file_uri, work_dir / "audio.wav") if audio_file_uri is not None else None
+			update_job_state(self, "COMBINING A/V")
+			with timed(timings, "concat_mux"):
+				frames = sum(segment["metadata"].get("frames", 0) for segment in segments)
+				duration = frames / float(os.environ["RENDER_FPS"]) if frames else None
+				output_file = concat_segments(segment_files, str(work_dir / "video.mp4"), str(audio_file) if audio_file is not None else None, duration)
+		finally:
+			release_files(audio_file_uri, *(segment["file"] for segment in segments))
+
+		with timed(timings, "upload"):
+			file_uri = publish_file(output_file)
+		metadata = dict(segments[0]["metadata"], segments=len(segments))
+		metadata["frames"] = frames
+		metadata["timings"] = job_timings(timings, metadata["frames"])
+		record_job_metrics(self.backend.client, self.request.id, metadata)
+		if cache_key is not None:
+			metadata["cache_key"] = cache_key
+		return {"file": file_uri, "metadata": metadata}
+
+
+@task_postrun.connect
+def finish_job(task_id=None, task=None, args=None, retval=None, state=None, **kwargs):
+	redis = task.backend.client
+	result = str(retval) if state == states.FAILURE else None
+	if state == states.FAILURE and task.name in ("tasks.render", "tasks.render_segment", "tasks.combine_segments"):
+		metrics.incr(redis, "genea_job_failures_total", reason=getattr(retval, "reason", type(retval).__name__), worker=WORKER_NAME)
+	if task.name == "tasks.render_segment" and state == states.FAILURE:
+		# the chord marks the job failed without running the combine task, so the job ends here
+		render_queue.finish(redis, args[0], False)
+		job_events.publish(redis, args[0], state, result)
+	# a sharded job ends with its combine task, which inherits the job id
+	if task.name not in ("tasks.render", "tasks.combine_segments") or state == states.IGNORED:
+		return
+	duration = render_queue.finish(redis, task_id, state == states.SUCCESS)
+	if duration is not None and state == states.SUCCESS:
+		metrics.observe(redis, "genea_job_run_seconds", duration, worker=WORKER_NAME)
+	job_events.publish(redis, task_id, state, result)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = metrics.exposition(celery.backend.client, WORKER_METRICS, help_texts=WORKER_METRICS, match={"worker": WORKER_NAME}).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		# scrapes would drown the task logs
+		pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+@worker_ready.connect
+def start_metrics_exporter(**kwargs):
+	if WORKER_METRICS_PORT > 0:
+		server = MetricsServer(("", WORKER_METRICS_PORT), MetricsHandler)
+		threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+		logger.info("exporting metrics on port %d", WORKER_METRICS_PORT)
@@ -0,0 +1,124 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Hand-off of the uploaded inputs and rendered videos between the API and the workers.
+# Artifacts are addressed by the "/files/<name>" URIs the API serves them under.
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+ARTIFACT_FOLDER = Path(os.environ.get("ARTIFACT_FOLDER", "/tmp/genea_visualizer"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def link_or_copy(source, destination):
+	try:
+		os.link(str(source), str(destination))
+	except OSError:
+		shutil.copyfile(str(source), str(destination))
+
+
+class ArtifactStore:
+	def fetch(self, uri: str, destination: Path) -> Path:
+		"""Makes the artifact available at destination and returns destination."""
+		raise NotImplementedError
+
+	def publish(self, file_name) -> str:
+		"""Hands a local file over to the API and returns its URI. The file may be moved."""
+		raise NotImplementedError
+
+	def release(self, uri: str):
+		"""Tells the store that an artifact is no longer needed by the worker."""
+		raise NotImplementedError
+
+	@contextmanager
+	def workdir(self):
+		with tempfile.TemporaryDirectory() as work_dir:
+			yield Path(work_dir)
+
+
+class HttpArtifactStore(ArtifactStore):
+	"""Goes through the API's /files and /upload_video endpoints, for workers without the shared volume."""
+
+	def __init__(self, api_server: str, token: str):
+		import requests
+
+		self.api_server = api_server
+		self.session = requests.Session()
+		self.session.headers["Authorization"] = f"Bearer {token}"
+
+	def fetch(self, uri, destination):
+		with self.session.get(self.api_server + uri, stream=True) as response:
+			response.raise_for_status()
+			with open(str(destination), "wb") as f:
+				for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+					f.write(chunk)
+		return destination
+
+	def publish(self, file_name):
+		with open(str(file_name), "rb") as file:
+			files = {"file": (os.path.basename(str(file_name)), file)}
+			response = self.session.post(self.api_server + "/upload_video", files=files)
+		response.raise_for_status()
+		return response.text
+
+	def release(self, uri):
+		pass  # the API deletes files once they have been fetched
+
+
+class FilesystemArtifactStore(ArtifactStore):
+	"""Works directly on the API's upload folder, shared with the workers through a volume.
+
+	Files are handed over by hard link or rename, so no artifact passes through the API.
+	"""
+
+	def __init__(self, folder: Path = ARTIFACT_FOLDER):
+		self.folder = folder
+		self.folder.mkdir(parents=True, exist_ok=True)
+
+	def path(self, uri: str) -> Path:
+		return self.folder / os.path.basename(uri)
+
+	def uri(self, path: Path) -> str:
+		return f"/files/{path.name}"
+
+	def fetch(self, uri, destination):
+		link_or_copy(self.path(uri), destination)
+		return destination
+
+	def publish(self, file_name):
+		_, extension = os.path.splitext(str(file_name))
+		path = self.folder / f"{uuid4()}{extension}"
+		shutil.move(str(file_name), str(path))
+		return self.uri(path)
+
+	def release(self, uri):
+		try:
+			self.path(uri).unlink()
+		except FileNotFoundError:
+			pass
+
+	@contextmanager
+	def workdir(self):
+		# on the shared volume, so that publishing the output is a rename
+		work_root = self.folder / "work"
+		work_root.mkdir(exist_ok=True)
+		with tempfile.TemporaryDirectory(dir=str(work_root)) as work_dir:
+			yield Path(work_dir)
+
+
+def get_artifact_store() -> ArtifactStore:
+	backend = os.environ.get("ARTIFACT_STORE", "http")
+	if backend == "filesystem":
+		return FilesystemArtifactStore()
+	if backend == "http":
+		return HttpArtifactStore(os.environ["API_SERVER"], os.environ["SYSTEM_TOKEN"])
+	raise ValueError(f"Unknown ARTIFACT_STORE {backend!r}, expected 'filesystem' or 'http'")
@@ -0,0 +1,93 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Checks that an uploaded BVH file can be rendered, in one pass over its lines and
+# without parsing the motion values, so that the API can run it before queueing a job.
+
+from pathlib import Path
+
+FRAME_EPSILON = 0.00001
+
+
+class BvhValidationError(ValueError):
+	pass
+
+
+def _field(lines, name: bytes) -> bytes:
+	"""The value of the next non-empty line, which must be "<name> <value>"."""
+	for line in lines:
+		line = line.strip()
+		if line:
+			break
+	else:
+		line = b""
+	if not line.startswith(name):
+		raise BvhValidationError(f"The {name.decode()} field is missing from the MOTION section")
+	return line[len(name):].strip()
+
+
+def validate_bvh(lines, max_frames: int = -1, frame_time: float = None) -> int:
+	"""Validates BVH data given as an iterable of byte lines (such as a binary file) and returns its number of frames.
+
+	max_frames -1 allows any number of frames; frame_time None allows any frame time.
+	"""
+	lines = iter(lines)
+	channels = 0
+	for line in lines:
+		parts = line.split()
+		if not parts:
+			continue
+		if parts[0] == b"MOTION":
+			break
+		if parts[0] == b"CHANNELS":
+			if len(parts) < 2 or not parts[1].isdigit():
+				raise BvhValidationError(f"Invalid CHANNELS line in the hierarchy ({line.strip().decode(errors='replace')})")
+			channels += int(parts[1])
+	else:
+		raise BvhValidationError("The file has no MOTION section")
+
+	frames_field = _field(lines, b"Frames:")
+	frame_time_field = _field(lines, b"Frame Time:")
+	try:
+		nframes = int(frames_field)
+		file_frame_time = float(frame_time_field)
+	except ValueError:
+		raise BvhValidationError(f"Invalid Frames ({frames_field.decode(errors='replace')}) or Frame Time ({frame_time_field.decode(errors='replace')}) field")
+
+	# checked before reading the motion data, so that oversized files are rejected early
+	if max_frames != -1 and nframes > max_frames:
+		raise BvhValidationError(
+			f"The supplied number of frames ({nframes}) is bigger than {max_frames}"
+		)
+
+	if frame_time is not None and (file_frame_time < frame_time - FRAME_EPSILON or file_frame_time > frame_time + FRAME_EPSILON):
+		raise BvhValidationError(
+			f"The supplied frame time ({file_frame_time}) differs from the required {frame_time} (+/- {FRAME_EPSILON})"
+		)
+
+	rows = 0
+	for line in lines:
+		values = len(line.split())
+		if not values:
+			continue
+		rows += 1
+		if values != channels:
+			raise BvhValidationError(
+				f"Row {rows} of the motion data has {values} values, but the hierarchy defines {channels} channels"
+			)
+
+	if nframes != rows:
+		raise BvhValidationError(
+			f"The number of rows with motion data ({rows}) does not match the Frames field ({nframes})"
+		)
+
+	return nframes
+
+
+def validate_bvh_file(file_name, max_frames: int = -1, frame_time: float = None) -> int:
+	with Path(file_name).open("rb") as f:
+		return validate_bvh(f, max_frames, frame_time)
@@ -0,0 +1,26 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# State changes of the render jobs, published by the workers on a Redis channel per job
+# and streamed to clients by the API. Events have the same {"state", "result"} shape as
+# the /jobid/<id> responses.
+
+import json
+
+FINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+
+def channel(job_id: str) -> str:
+	return f"genea:job:{job_id}"
+
+
+def publish(redis, job_id: str, state: str, result=None):
+	redis.publish(channel(job_id), json.dumps({"state": state, "result": result}))
+
+
+def parse(message) -> dict:
+	return json.loads(message["data"])
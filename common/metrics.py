@@ -0,0 +1,120 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Counters and histograms kept in Redis, so that every API and worker process adds to
+# the same series, and rendered in the Prometheus text format by whoever exports them.
+# Histograms are cumulative: a hash per series, with a count per bucket upper bound
+# ("le") plus "sum" and "count".
+#
+# Like render_queue, this only uses commands whose redis-py signatures are the same on
+# the worker and on the API.
+
+import json
+import math
+
+COUNTERS_KEY = "genea:metrics:counters"  # hash of JSON [name, labels] -> value
+HISTOGRAMS_KEY = "genea:metrics:histograms"  # set of JSON [name, labels] with a histogram
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, math.inf)
+
+
+def _series(name: str, labels: dict) -> str:
+	return json.dumps([name, labels], sort_keys=True)
+
+
+def _histogram_key(series: str) -> str:
+	return f"genea:metrics:histogram:{series}"
+
+
+def _bound(bound: float) -> str:
+	return "+Inf" if bound == math.inf else str(bound)
+
+
+def incr(redis, name: str, amount: float = 1, **labels):
+	redis.hincrbyfloat(COUNTERS_KEY, _series(name, labels), amount)
+
+
+def observe(redis, name: str, value: float, pipe=None, **labels):
+	"""Adds a value to a histogram; with pipe, the commands are only queued on it."""
+	series = _series(name, labels)
+	key = _histogram_key(series)
+	commands = pipe if pipe is not None else redis.pipeline()
+	commands.sadd(HISTOGRAMS_KEY, series)
+	for bound in BUCKETS:
+		if value <= bound:
+			commands.hincrby(key, _bound(bound), 1)
+	commands.hincrbyfloat(key, "sum", value)
+	commands.hincrby(key, "count", 1)
+	if pipe is None:
+		commands.execute()
+
+
+def observe_timings(redis, timings: dict, **labels):
+	"""Adds the {stage: seconds} of one job to the genea_stage_seconds histograms."""
+	pipe = redis.pipeline()
+	for stage, seconds in timings.items():
+		observe(redis, "genea_stage_seconds", seconds, pipe, stage=stage, **labels)
+	pipe.execute()
+
+
+def _labels(labels: dict) -> str:
+	if not labels:
+		return ""
+	values = ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in sorted(labels.items()))
+	return "{" + values + "}"
+
+
+def _number(value: float) -> str:
+	return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def exposition(redis, names, computed=(), help_texts=None, match=None) -> str:
+	"""The Prometheus text format of the stored counters and histograms whose name is in
+	names and whose labels include match, plus computed, a list of (name, type, labels,
+	value) samples the caller worked out itself."""
+	help_texts = help_texts or {}
+	match = match or {}
+	families = {}
+
+	def family(name, kind):
+		if name not in families:
+			families[name] = (kind, [])
+		return families[name][1]
+
+	def wanted(name, labels):
+		return name in names and all(labels.get(label) == value for label, value in match.items())
+
+	for name, kind, labels, value in computed:
+		family(name, kind).append((name, labels, value))
+
+	for series, value in redis.hgetall(COUNTERS_KEY).items():
+		name, labels = json.loads(series)
+		if wanted(name, labels):
+			family(name, "counter").append((name, labels, float(value)))
+
+	histogram_series = [json.loads(series) for series in redis.smembers(HISTOGRAMS_KEY)]
+	histogram_series = [(name, labels) for name, labels in histogram_series if wanted(name, labels)]
+	pipe = redis.pipeline()
+	for name, labels in histogram_series:
+		pipe.hgetall(_histogram_key(_series(name, labels)))
+	for (name, labels), fields in zip(histogram_series, pipe.execute()):
+		fields = {field.decode("utf-8"): value for field, value in fields.items()}
+		samples = family(name, "histogram")
+		# counts are stored per bucket a value fell in and below, so they are cumulative already
+		for bound in BUCKETS:
+			samples.append((f"{name}_bucket", dict(labels, le=_bound(bound)), int(fields.get(_bound(bound), 0))))
+		samples.append((f"{name}_sum", labels, float(fields.get("sum", 0))))
+		samples.append((f"{name}_count", labels, int(fields.get("count", 0))))
+
+	lines = []
+	for name in sorted(families):
+		kind, samples = families[name]
+		if name in help_texts:
+			lines.append(f"# HELP {name} {help_texts[name]}")
+		lines.append(f"# TYPE {name} {kind}")
+		for sample_name, labels, value in samples:
+			lines.append(f"{sample_name}{_labels(labels)} {_number(value)}")
+	return "\n".join(lines) + "\n"
@@ -0,0 +1,103 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Queue positions of the render jobs, kept in Redis by the API (enqueue) and the workers
+# (start/finish), so that a status poll never has to ask the workers.
+#
+# The worker image pins an older redis-py than the API, so the worker side only uses
+# commands whose signatures did not change between the two (no ZADD).
+
+import math
+import time
+
+QUEUE_KEY = "genea:render_queue"  # sorted set of waiting job ids, scored by enqueue time
+OWNERS_KEY = "genea:render_queue_owners"  # hash of waiting job id -> owner, who has a queue of their own
+STARTED_KEY = "genea:render_started"  # hash of running job id -> start time
+DURATIONS_KEY = "genea:render_durations"  # list of the most recent job durations in seconds
+RECENT_DURATIONS = 50
+# jobs lost without a start, e.g. while the broker was down, are dropped from the queue after this
+MAX_QUEUE_AGE = 24 * 60 * 60
+
+
+def owner_queue_key(owner: str) -> str:
+	return f"{QUEUE_KEY}:{owner}"
+
+
+def enqueue(redis, job_id: str, owner: str = None):
+	now = time.time()
+	pipe = redis.pipeline()
+	pipe.zremrangebyscore(QUEUE_KEY, 0, now - MAX_QUEUE_AGE)
+	pipe.zadd(QUEUE_KEY, {job_id: now})
+	if owner is not None:
+		pipe.zremrangebyscore(owner_queue_key(owner), 0, now - MAX_QUEUE_AGE)
+		pipe.zadd(owner_queue_key(owner), {job_id: now})
+		pipe.hset(OWNERS_KEY, job_id, owner)
+	pipe.execute()
+
+
+def start(redis, job_id: str):
+	"""Moves the job from the queue to the running jobs, and returns how long it waited (None if unknown)."""
+	now = time.time()
+	pipe = redis.pipeline()
+	pipe.hget(OWNERS_KEY, job_id)
+	pipe.zscore(QUEUE_KEY, job_id)
+	owner, enqueued = pipe.execute()
+	pipe = redis.pipeline()
+	pipe.zrem(QUEUE_KEY, job_id)
+	if owner is not None:
+		pipe.zrem(owner_queue_key(owner.decode("utf-8")), job_id)
+		pipe.hdel(OWNERS_KEY, job_id)
+	pipe.hset(STARTED_KEY, job_id, now)
+	pipe.execute()
+	return now - enqueued if enqueued is not None else None
+
+
+def queued(redis, owner: str = None) -> int:
+	"""Number of waiting jobs, in total or of one owner."""
+	return redis.zcard(QUEUE_KEY if owner is None else owner_queue_key(owner))
+
+
+def running(redis) -> int:
+	return redis.hlen(STARTED_KEY)
+
+
+def mean_duration(redis):
+	"""Mean duration of the recent jobs in seconds, None before any job finished."""
+	durations = redis.lrange(DURATIONS_KEY, 0, -1)
+	if not durations:
+		return None
+	return sum(float(duration) for duration in durations) / len(durations)
+
+
+def finish(redis, job_id: str, succeeded: bool):
+	"""Removes the job from the running jobs, and returns how long it ran (None if unknown)."""
+	started = redis.hget(STARTED_KEY, job_id)
+	duration = time.time() - float(started) if started is not None else None
+	pipe = redis.pipeline()
+	pipe.hdel(STARTED_KEY, job_id)
+	if duration is not None and succeeded:
+		pipe.lpush(DURATIONS_KEY, duration)
+		pipe.ltrim(DURATIONS_KEY, 0, RECENT_DURATIONS - 1)
+	pipe.execute()
+	return duration
+
+
+def status(redis, job_id: str, workers: int = 1) -> dict:
+	"""Queue length, and the job's 0-based position and estimated wait when it is queued."""
+	pipe = redis.pipeline()
+	pipe.zcard(QUEUE_KEY)
+	pipe.zrank(QUEUE_KEY, job_id)
+	pipe.lrange(DURATIONS_KEY, 0, -1)
+	length, position, durations = pipe.execute()
+
+	result = {"jobs_in_queue": length}
+	if position is not None:
+		result["queue_position"] = position
+		if durations:
+			mean_duration = sum(float(duration) for duration in durations) / len(durations)
+			result["eta_seconds"] = round(math.ceil((position + 1) / workers) * mean_duration)
+	return result
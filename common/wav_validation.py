@@ -0,0 +1,59 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Checks the header of an uploaded WAV file, so that the API can turn away files that
+# are not audio before queueing a job. Only the RIFF structure is checked: the codec
+# (PCM, float, WAVE_FORMAT_EXTENSIBLE, ...) is left to ffmpeg, which muxes the audio.
+
+import struct
+from pathlib import Path
+
+
+class WavValidationError(ValueError):
+	pass
+
+
+def _chunks(f):
+	"""Yields (chunk id, size) of the chunks of a RIFF file, positioned at their data."""
+	while True:
+		header = f.read(8)
+		if len(header) < 8:
+			return
+		chunk_id, size = struct.unpack("<4sI", header)
+		start = f.tell()
+		yield chunk_id, size
+		# chunks are padded to an even size
+		f.seek(start + size + (size & 1))
+
+
+def validate_wav(f):
+	"""Validates the header of a WAV file opened in binary mode, returns (channels, sample rate)."""
+	header = f.read(12)
+	if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WAVE":
+		raise WavValidationError("The file is not a RIFF/WAVE file")
+
+	fmt = None
+	for chunk_id, size in _chunks(f):
+		if chunk_id == b"fmt ":
+			if size < 16:
+				raise WavValidationError(f"The fmt chunk is too short ({size} bytes)")
+			fmt = struct.unpack("<HHI", f.read(8))
+		elif chunk_id == b"data":
+			if fmt is None:
+				raise WavValidationError("The data chunk comes before the fmt chunk")
+			if size == 0:
+				raise WavValidationError("The supplied WAV file has no audio")
+			_, channels, sample_rate = fmt
+			if channels < 1 or sample_rate <= 0:
+				raise WavValidationError(f"Invalid fmt chunk ({channels} channels at {sample_rate} Hz)")
+			return channels, sample_rate
+	raise WavValidationError("The file has no data chunk" if fmt is not None else "The file has no fmt chunk")
+
+
+def validate_wav_file(file_name):
+	with Path(file_name).open("rb") as f:
+		return validate_wav(f)
@@ -0,0 +1,222 @@
+# Copyright 2020 by Patrik Jonell.
+# All rights reserved.
+# This file is part of the GENEA visualizer,
+# and is released under the GPLv3 License. Please see the LICENSE
+# file that should have been included as part of this package.
+
+
+# Renders a whole directory (or JSON manifest) of BVH files, with the WAV files of the
+# same name, through the visualization server. Jobs run with bounded concurrency, and
+# progress is kept in a state file, so an interrupted run picks up where it stopped.
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input', type=Path, help='A directory searched for .bvh files (with optional .wav files of the same name), or a JSON manifest: a list of {"bvh": ..., "audio": ...} entries.')
+parser.add_argument('-m', "--visualization_mode", help='The visualization mode to use for rendering.', type=str, choices=['full_body', 'upper_body'], default='full_body')
+parser.add_argument('-s', '--server_url', default="http://localhost:5001")
+parser.add_argument('-t', '--token', default="j7HgTkwt24yKWfHPpFG3eoydJK6syAsz")
+parser.add_argument('-r', '--rotate', help='Set to "cw" to rotate avatar 90 degrees clockwise, "ccw" for 90 degrees counter-clockwise, "flip" for 180-degree rotation, and leave at "default" for no rotation (or ignore the flag).', type=str, choices=['default', 'cw', 'ccw', 'flip'], default='default')
+parser.add_argument('-o', '--output_dir', help='Where the .mp4 files are written, mirroring the input layout. Defaults to next to the BVH files.', type=Path)
+parser.add_argument('-j', '--jobs', help='How many files are in flight at the same time.', type=int, default=4)
+parser.add_argument('--state_file', help='Where the progress is kept. Defaults to .genea_batch_state.json in the output directory (or the input directory).', type=Path)
+parser.add_argument('--profile', help='The scene level of detail: "draft" and "standard" render faster with a simpler sky, speech bubbles and textures.', type=str, choices=['draft', 'standard', 'final'], default='final')
+parser.add_argument('--stream', help='Follow the jobs through their event streams instead of polling.', action='store_true')
+parser.add_argument('--retry_failed', help='Try the files that failed in a previous run again.', action='store_true')
+
+args = parser.parse_args()
+
+headers = {"Authorization": f"Bearer {args.token}"}
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 30
+# submissions turned away with 429 are retried after the server's Retry-After, at most this long
+MAX_RETRY_AFTER = 300
+# a job that is PENDING without a queue position this many times in a row is unknown to the server
+LOST_JOB_STATUSES = 5
+
+
+def find_pairs():
+	"""[(name, bvh file, audio file or None)], named by the BVH path relative to the input."""
+	if args.input.is_dir():
+		pairs = []
+		for bvh_file in sorted(args.input.rglob("*.bvh")):
+			audio_file = bvh_file.with_suffix(".wav")
+			name = str(bvh_file.relative_to(args.input).with_suffix(""))
+			pairs.append((name, bvh_file, audio_file if audio_file.exists() else None))
+		return pairs
+	manifest = json.loads(args.input.read_text())
+	base = args.input.parent
+	return [
+		(str(Path(entry["bvh"]).with_suffix("")), base / entry["bvh"], base / entry["audio"] if entry.get("audio") else None)
+		for entry in manifest
+	]
+
+
+def output_path(name, bvh_file):
+	if args.output_dir:
+		return args.output_dir / f"{name}.mp4"
+	return bvh_file.with_suffix(".mp4")
+
+
+class State:
+	"""The progress of every file, written atomically after every change."""
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.entries = json.loads(path.read_text()) if path.exists() else {}
+
+	def get(self, name):
+		with self.lock:
+			return dict(self.entries.get(name, {}))
+
+	def set(self, name, **entry):
+		with self.lock:
+			self.entries[name] = entry
+			tmp_path = self.path.with_name(self.path.name + ".tmp")
+			tmp_path.write_text(json.dumps(self.entries, indent=1))
+			os.replace(tmp_path, self.path)
+
+
+def submit(session, bvh_file, audio_file):
+	params = {'p_rotate': args.rotate, 'visualization_mode': args.visualization_mode, 'profile': args.profile}
+	while True:
+		files = {"bvh_file": (bvh_file.name, bvh_file.open("rb"))}
+		if audio_file:
+			files["audio_file"] = (audio_file.name, audio_file.open("rb"))
+		try:
+			resp = session.post(f"{args.server_url}/render", params=params, files=files, timeout=60)
+		finally:
+			for _, file in files.values():
+				file.close()
+		if resp.status_code == 429:
+			# the queue is full, wait for a slot as suggested by the server
+			time.sleep(min(int(resp.headers.get("Retry-After", 60)), MAX_RETRY_AFTER) * random.uniform(1, 1.5))
+			continue
+		if resp.status_code == 400:
+			raise ValueError(resp.json()["detail"])
+		resp.raise_for_status()
+		return resp.text
+
+
+class LostJobs:
+	"""Spots jobs the server does not know, e.g. ones submitted before its queue was lost."""
+
+	def __init__(self):
+		self.count = 0
+
+	def check(self, response):
+		unknown = response["state"] == "PENDING" and "queue_position" not in response["result"]
+		self.count = self.count + 1 if unknown else 0
+		if self.count >= LOST_JOB_STATUSES:
+			raise LookupError("The server does not know the job")
+
+
+def poll(session, job_uri):
+	"""Polls the job with a backoff that resets whenever the job changes state."""
+	interval = MIN_POLL_INTERVAL
+	last_state = None
+	lost = LostJobs()
+	while True:
+		resp = session.get(args.server_url + job_uri, timeout=30)
+		resp.raise_for_status()
+		response = resp.json()
+		if response["state"] in ("SUCCESS", "FAILURE"):
+			return response
+		lost.check(response)
+		# the progress moves on every poll while rendering, so only a new state counts
+		interval = MIN_POLL_INTERVAL if response["state"] != last_state else min(interval * 2, MAX_POLL_INTERVAL)
+		last_state = response["state"]
+		time.sleep(interval)
+
+
+def follow(session, job_uri):
+	"""Waits for the job on its event stream, falling back to polling if the stream breaks off."""
+	lost = LostJobs()
+	try:
+		with session.get(args.server_url + job_uri + "/events", stream=True, timeout=(10, 60)) as resp:
+			resp.raise_for_status()
+			for line in resp.iter_lines(decode_unicode=True):
+				if line.startswith("data: "):
+					response = json.loads(line[len("data: "):])
+					if response["state"] in ("SUCCESS", "FAILURE"):
+						return response
+					lost.check(response)
+	except requests.RequestException:
+		pass
+	return poll(session, job_uri)
+
+
+def download(session, file_url, output):
+	output.parent.mkdir(parents=True, exist_ok=True)
+	tmp_output = output.with_name(output.name + ".part")
+	with session.get(args.server_url + file_url, stream=True, timeout=60) as resp:
+		resp.raise_for_status()
+		with tmp_output.open("wb") as f:
+			for chunk in resp.iter_content(1024 * 1024):
+				f.write(chunk)
+	os.replace(tmp_output, output)
+
+
+def render(state, name, bvh_file, audio_file):
+	session = requests.Session()
+	session.headers.update(headers)
+	output = output_path(name, bvh_file)
+
+	entry = state.get(name)
+	job_uri = entry.get("job") if entry.get("status") == "submitted" else None
+	while True:
+		if job_uri is None:
+			try:
+				job_uri = submit(session, bvh_file, audio_file)
+			except ValueError as e:
+				state.set(name, status="failed", error=str(e))
+				return name, "failed", str(e)
+			state.set(name, status="submitted", job=job_uri)
+		try:
+			response = follow(session, job_uri) if args.stream else poll(session, job_uri)
+			break
+		except LookupError:
+			job_uri = None
+	if response["state"] == "FAILURE":
+		state.set(name, status="failed", job=job_uri, error=str(response["result"]))
+		return name, "failed", str(response["result"])
+	download(session, response["result"], output)
+	state.set(name, status="done", job=job_uri, output=str(output))
+	return name, "done", str(output)
+
+
+pairs = find_pairs()
+state_file = args.state_file or (args.output_dir or (args.input if args.input.is_dir() else args.input.parent)) / ".genea_batch_state.json"
+state_file.parent.mkdir(parents=True, exist_ok=True)
+state = State(state_file)
+
+skipped_states = {"done"} if args.retry_failed else {"done", "failed"}
+todo = [pair for pair in pairs if state.get(pair[0]).get("status") not in skipped_states]
+print(f"{len(pairs)} files, {len(pairs) - len(todo)} already handled (state in {state_file}), {len(todo)} to render with {args.jobs} at a time")
+
+finished = 0
+failed = 0
+with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+	futures = {executor.submit(render, state, *pair): pair[0] for pair in todo}
+	for future in as_completed(futures):
+		finished += 1
+		try:
+			name, status, detail = future.result()
+		except Exception as e:
+			# e.g. the server went away; the file is retried by the next run
+			name, status, detail = futures[future], "error", repr(e)
+		if status != "done":
+			failed += 1
+		print(f"[{finished}/{len(todo)}] {name}: {status} ({detail})")
+
+print(f"Finished: {finished - failed} rendered, {failed} failed or interrupted")
@@ -0,0 +1,70 @@
+import io
+import struct
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+
+from wav_validation import WavValidationError, validate_wav  # noqa: E402
+
+# the subformat GUID of WAVE_FORMAT_EXTENSIBLE PCM audio
+KSDATAFORMAT_SUBTYPE_PCM = b"\x01\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+
+
+def riff(*chunks):
+	body = b"WAVE" + b"".join(struct.pack("<4sI", chunk_id, len(data)) + data + b"\0" * (len(data) & 1) for chunk_id, data in chunks)
+	return io.BytesIO(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+
+def pcm_wav(channels=1, sample_rate=16000, frames=100):
+	f = io.BytesIO()
+	with wave.open(f, "wb") as wav:
+		wav.setnchannels(channels)
+		wav.setsampwidth(2)
+		wav.setframerate(sample_rate)
+		wav.writeframes(b"\0\0" * channels * frames)
+	f.seek(0)
+	return f
+
+
+def extensible_fmt(channels, sample_rate, bits):
+	block_align = channels * bits // 8
+	return struct.pack(
+		"<HHIIHHHHI16s", 0xFFFE, channels, sample_rate, sample_rate * block_align, block_align, bits,
+		22, bits, 0x3, KSDATAFORMAT_SUBTYPE_PCM,
+	)
+
+
+def test_pcm():
+	assert validate_wav(pcm_wav(2, 44100)) == (2, 44100)
+
+
+def test_extensible_24_bit():
+	# what many tools write for 24-bit or multichannel audio, which the wave module refuses
+	f = riff((b"fmt ", extensible_fmt(2, 48000, 24)), (b"data", b"\0" * 6 * 10))
+	with pytest.raises(wave.Error):
+		wave.open(io.BytesIO(f.getvalue()))
+	assert validate_wav(f) == (2, 48000)
+
+
+def test_skips_other_chunks():
+	fmt = struct.pack("<HHIIHH", 3, 1, 22050, 22050 * 4, 4, 32)
+	f = riff((b"LIST", b"INFOodd"), (b"fmt ", fmt), (b"fact", b"\0" * 4), (b"data", b"\0" * 40))
+	assert validate_wav(f) == (1, 22050)
+
+
+@pytest.mark.parametrize("f", [
+	io.BytesIO(b"not a wav file at all"),
+	io.BytesIO(b""),
+	riff((b"fmt ", extensible_fmt(1, 16000, 16))),
+	riff((b"data", b"\0" * 4)),
+	riff((b"fmt ", extensible_fmt(1, 16000, 16)), (b"data", b"")),
+	riff((b"fmt ", b"\0" * 8), (b"data", b"\0" * 4)),
+	riff((b"fmt ", extensible_fmt(0, 16000, 16)), (b"data", b"\0" * 4)),
+])
+def test_invalid(f):
+	with pytest.raises(WavValidationError):
+		validate_wav(f)